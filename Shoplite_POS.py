@@ -1,20 +1,35 @@
 # app.py
+import atexit
+import base64
+import difflib
+import functools
 import hashlib
 import os
+import re
 import sys
 import sqlite3
 import threading
 import time
 import queue
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, make_response
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain, groupby, islice
+from datetime import datetime, timedelta, timezone
+from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, make_response, g
 import webview
 import ctypes.wintypes
 import json
 import csv
+import unicodedata
+import io
 from io import StringIO
 from flask import Flask, render_template, make_response
 
+try:
+    import numpy as np
+except ImportError:   # demand forecasting is unavailable without NumPy
+    np = None
+
 # =========================================
 # Configure folder in My Documents
 # =========================================
@@ -50,20 +65,477 @@ pos_window = None
 # =========================================
 # Database connection
 # =========================================
+DB_POOL_SIZE = 8          # max open SQLite connections (waitress uses 4 worker threads by default)
+DB_POOL_TIMEOUT = 10      # seconds to wait for a free connection before giving up
+
+# Closed ledger months live in <db>_archive.db, attached to every connection as "archive".
+# transactions_all (a temp view) is the hot ledger plus every fully archived month.
+LEDGER_COLUMNS = "id, product_id, barcode, transaction_type, quantity, price, total_value, timestamp, notes, unit_cost"
+# Re-created on connect as well, so a lost or not-restored archive file never breaks transactions_all
+ARCHIVE_SCHEMA_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS archive.transactions_archive (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER,
+        barcode TEXT,
+        transaction_type TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        price REAL,
+        total_value REAL,
+        timestamp TIMESTAMP,
+        notes TEXT,
+        unit_cost REAL,
+        month TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_month ON transactions_archive(month)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_type_ts ON transactions_archive(transaction_type, timestamp)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_product ON transactions_archive(product_id)",
+)
+TRANSACTIONS_ALL_VIEW_SQL = f"""
+    CREATE TEMP VIEW IF NOT EXISTS transactions_all AS
+    SELECT {LEDGER_COLUMNS} FROM main.transactions
+    UNION ALL
+    SELECT {LEDGER_COLUMNS} FROM archive.transactions_archive
+    WHERE month IN (SELECT month FROM main.ledger_archive_log WHERE status = 'done')
+"""
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that goes back to its pool on close() instead of closing.
+    Ledger rows deferred during a transaction (group-commit mode) are handed to the
+    ledger writer on commit() and dropped on rollback().
+    """
+
+    _pool = None
+    _checked_out = False
+    _deferred_ledger = ()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            sqlite3.Connection.close(self)
+
+    def commit(self):
+        sqlite3.Connection.commit(self)
+        if self._deferred_ledger:
+            rows, self._deferred_ledger = self._deferred_ledger, ()
+            LEDGER.enqueue(rows)
+
+    def rollback(self):
+        sqlite3.Connection.rollback(self)
+        self._deferred_ledger = ()
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+    - PRAGMAs are applied once, when a connection is opened
+    - a thread gets back the connection it used last when it is idle (per-thread affinity)
+    - when all connections are busy, acquire() waits up to DB_POOL_TIMEOUT seconds
+    """
+
+    def __init__(self, path, max_connections=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.archive_path = os.path.splitext(path)[0] + "_archive.db"
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA busy_timeout = 5000;")   # wait up to 5 seconds when DB is locked
+        conn.execute("PRAGMA journal_mode = WAL;")    # better concurrent reads/writes
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        conn.execute("PRAGMA archive.journal_mode = WAL;")
+        for sql in ARCHIVE_SCHEMA_SQL:
+            conn.execute(sql)
+        conn.execute(TRANSACTIONS_ALL_VIEW_SQL)        # resolved lazily, so fine before migration 12
+        conn._pool = self
+        return conn
+
+    def acquire(self):
+        with self._cond:
+            waited = False
+            while True:
+                if self._idle:
+                    own = getattr(self._local, "conn", None)
+                    if own is not None and own in self._idle:
+                        self._idle.remove(own)
+                        conn = own
+                    else:
+                        conn = self._idle.pop()
+                    self.hits += 1
+                    break
+                if self._open < self.max_connections:
+                    self._open += 1
+                    self.misses += 1
+                    conn = None
+                    break
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                if not self._cond.wait(timeout=self.timeout):
+                    raise sqlite3.OperationalError("Database connection pool exhausted")
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+
+        conn._checked_out = True
+        self._local.conn = conn
+        return conn
+
+    def release(self, conn):
+        if not conn._checked_out:
+            return
+        conn._checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection: drop it instead of returning it to the pool
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            sqlite3.Connection.close(conn)
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Connection for code running outside a request (startup, streaming, background jobs)"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            total = self.hits + self.misses
+            return {
+                "max_connections": self.max_connections,
+                "open": self._open,
+                "idle": idle,
+                "in_use": self._open - idle,
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+POOL = ConnectionPool(DB_PATH)
+atexit.register(POOL.close_all)
+
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA busy_timeout = 5000;")   # wait up to 5 seconds when DB is locked
-    conn.execute("PRAGMA journal_mode = WAL;")    # better concurrent reads/writes
-    return conn
+    """Pooled connection; close() hands it back to the pool"""
+    return POOL.acquire()
 
 
-def init_database():
-    conn = get_db_connection()
-    c = conn.cursor()
+def get_db():
+    """Request-scoped connection, returned to the pool on teardown"""
+    if "db" not in g:
+        g.db = POOL.acquire()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        POOL.release(conn)
+
+
+# =========================================
+# Product catalog cache (scan hot path)
+# =========================================
+PRODUCT_LOOKUP_SQL = """
+    SELECT p.*, c.name as category_name, s.name as supplier_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    LEFT JOIN suppliers s ON p.supplier_id = s.id
+    WHERE p.barcode = ?
+"""
+
+
+class CatalogCache:
+    """
+    barcode -> product row (with category_name / supplier_name), filled on first scan.
+    Stock is never served from the cache: get() re-reads quantity by primary key,
+    so only product/category/supplier edits need to invalidate entries.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._generation = 0      # bumped on every invalidation, guards against storing stale loads
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, conn, barcode):
+        """Product dict for barcode with current quantity, or None"""
+        with self._lock:
+            item = self._items.get(barcode)
+            if item is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                generation = self._generation
+
+        if item is None:
+            row = conn.execute(PRODUCT_LOOKUP_SQL, (barcode,)).fetchone()
+            if row is None:
+                return None
+            item = dict(row)
+            with self._lock:
+                if generation == self._generation:
+                    self._items[barcode] = item
+            return dict(item)
+
+        stock = conn.execute("SELECT quantity FROM products WHERE id = ?", (item['id'],)).fetchone()
+        if stock is None:
+            self.invalidate(barcode)
+            return None
+        product = dict(item)
+        product['quantity'] = stock['quantity']
+        return product
+
+    def invalidate(self, barcode):
+        with self._lock:
+            self._items.pop(barcode, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+CATALOG = CatalogCache()
+
+
+RESULT_CACHE_SIZE = 64      # cached responses kept (least recently used are evicted)
+RESULT_CACHE_TTL = 300      # seconds; upper bound on staleness for anything the versions miss
+
+
+class ResultCache:
+    """
+    key -> response body for read-only report endpoints.
+    Each entry remembers the data version it was computed at; a lookup with a different
+    version (any ledger or catalog write since) is a miss, as is an entry older than the TTL.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items = OrderedDict()   # key -> (version, stored_at, body, compute_ms)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+        self.recompute_ms = 0.0
+        self.saved_ms = 0.0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                if entry[0] != version:
+                    self.stale += 1
+                    entry = None
+                elif time.monotonic() - entry[1] > self.ttl:
+                    self.expired += 1
+                    entry = None
+            if entry is None:
+                self._items.pop(key, None)
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += entry[3]
+            return entry[2]
+
+    def put(self, key, version, body, compute_ms):
+        with self._lock:
+            self.recompute_ms += compute_ms
+            self._items[key] = (version, time.monotonic(), body, compute_ms)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "recompute_ms": round(self.recompute_ms, 2),
+                "avg_recompute_ms": round(self.recompute_ms / self.misses, 2) if self.misses else 0.0,
+                "saved_ms": round(self.saved_ms, 2)
+            }
+
+
+ANALYTICS_CACHE = ResultCache()
+
+
+# =========================================
+# Server-Sent Events broker
+# =========================================
+SSE_QUEUE_SIZE = 100        # pending events per subscriber before it is told to resync
+SSE_MAX_SUBSCRIBERS = 4     # each open stream holds one waitress worker thread
+SSE_HEARTBEAT = 15          # seconds between keep-alive comments
+SSE_STREAM_SECONDS = 300    # streams end after this; EventSource reconnects on its own
+SERVER_THREADS = 8          # waitress worker threads (leaves room for regular requests)
+
+
+class EventBroker:
+    """Fan-out of (event, data) tuples to bounded per-subscriber queues"""
+
+    def __init__(self, queue_size=SSE_QUEUE_SIZE, max_subscribers=SSE_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        """New subscriber queue, or None when all stream slots are taken"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            q = queue.Queue(maxsize=self.queue_size)
+            self._subscribers.add(q)
+            return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # Slow client: throw its backlog away and tell it to reload instead
+                dropped = 0
+                while True:
+                    try:
+                        q.get_nowait()
+                        dropped += 1
+                    except queue.Empty:
+                        break
+                with self._lock:
+                    self.dropped += dropped
+                try:
+                    q.put_nowait(("resync", {}))
+                except queue.Full:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "max_subscribers": self.max_subscribers,
+                "published": self.published,
+                "dropped": self.dropped
+            }
+
+
+EVENTS = EventBroker()
+
+
+def publish_stock_changes(changes):
+    """
+    changes: [(product_row_before, new_quantity)], published after commit.
+    Emits a 'stock' event per product and 'low_stock' when it falls to min_stock or below.
+    """
+    for before, new_quantity in changes:
+        payload = {
+            "product_id": before['id'],
+            "barcode": before['barcode'],
+            "name": before['name'],
+            "quantity": new_quantity,
+            "min_stock": before['min_stock']
+        }
+        EVENTS.publish("stock", payload)
+        if before['quantity'] > before['min_stock'] >= new_quantity:
+            EVENTS.publish("low_stock", payload)
+
+
+# =========================================
+# Schema migrations (PRAGMA user_version)
+# =========================================
+
+def _column_exists(conn, table, column):
+    return any(row["name"] == column for row in conn.execute(f"PRAGMA table_info({table})"))
 
-    c.execute("""
+
+def _add_column(conn, table, column, decl):
+    """ALTER TABLE ... ADD COLUMN, skipped when the column is already there"""
+    if not _column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _migration_001_base_schema(conn):
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS suppliers (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL UNIQUE,
@@ -73,7 +545,7 @@ def init_database():
     )
     """)
 
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS categories (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL UNIQUE,
@@ -81,7 +553,7 @@ def init_database():
     )
     """)
 
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS products (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         barcode TEXT UNIQUE NOT NULL,
@@ -99,14 +571,7 @@ def init_database():
     )
     """)
 
-    # Migration: add supplier_code to products if missing
-    try:
-        c.execute("ALTER TABLE products ADD COLUMN supplier_code TEXT")
-    except Exception:
-        # Column already exists, ignore
-        pass
-
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS transactions (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         product_id INTEGER,
@@ -121,7 +586,7 @@ def init_database():
     )
     """)
 
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS purchase_orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         supplier_id INTEGER,
@@ -135,7 +600,7 @@ def init_database():
     )
     """)
 
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS purchase_order_items (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         order_id INTEGER,
@@ -151,23 +616,623 @@ def init_database():
     )
     """)
 
-    # Ensure extra columns on purchase_orders
-    try:
-        c.execute("ALTER TABLE purchase_orders ADD COLUMN invoice_number TEXT")
-    except Exception:
-        pass
+    # Columns added after the first release (older databases may already have them)
+    _add_column(conn, "products", "supplier_code", "TEXT")
+    _add_column(conn, "purchase_orders", "invoice_number", "TEXT")
+    _add_column(conn, "purchase_orders", "invoice_date", "TEXT")
+    _add_column(conn, "purchase_orders", "date_received", "TEXT")
+
+
+def _migration_002_indexes(conn):
+    # Analytics filter sales by type + time range, turnover/top products group by product
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_type_ts ON transactions(transaction_type, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_product ON transactions(product_id)")
+    # PO detail / exports fetch items per order
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_po_items_order ON purchase_order_items(order_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_po_supplier ON purchase_orders(supplier_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_po_status ON purchase_orders(status)")
+    # Catalog filters and ORDER BY p.name
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_supplier ON products(supplier_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products(name)")
+
+
+def _migration_003_sales(conn):
+    # Named counters (receipt numbers, ...) incremented inside the writer's transaction
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO sequences (name, value) VALUES ('receipt', 0)")
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        receipt_number TEXT UNIQUE NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        payment_method TEXT NOT NULL,
+        total_amount REAL DEFAULT 0.0,
+        payment_amount REAL DEFAULT 0.0,
+        change_amount REAL DEFAULT 0.0,
+        items_count INTEGER DEFAULT 0
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sale_lines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sale_id INTEGER NOT NULL,
+        product_id INTEGER,
+        barcode TEXT,
+        product_name TEXT,
+        quantity INTEGER NOT NULL,
+        unit_price REAL DEFAULT 0.0,
+        line_total REAL DEFAULT 0.0,
+        FOREIGN KEY (sale_id) REFERENCES sales(id) ON DELETE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE SET NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_timestamp ON sales(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_payment_ts ON sales(payment_method, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sale_lines_sale ON sale_lines(sale_id)")
+
+    # Backfill receipts that only exist as "POS Sale - Receipt: R<secs> - <METHOD>" in transactions.notes
+    prefix = "POS Sale - Receipt: "
+    receipts = {}
+    for row in conn.execute("""
+        SELECT t.product_id, t.barcode, t.quantity, t.price, t.total_value, t.timestamp, t.notes, p.name
+        FROM transactions t
+        LEFT JOIN products p ON p.id = t.product_id
+        WHERE t.transaction_type = 'sale' AND t.notes LIKE 'POS Sale - Receipt: %'
+        ORDER BY t.id
+    """):
+        receipt, _, method = row["notes"][len(prefix):].partition(" - ")
+        sale = receipts.setdefault(receipt, {"timestamp": row["timestamp"], "method": method or "CASH", "lines": []})
+        sale["lines"].append(row)
+
+    for receipt, sale in receipts.items():
+        total = sum(line["total_value"] or 0 for line in sale["lines"])
+        cur = conn.execute("""
+            INSERT INTO sales (receipt_number, timestamp, payment_method, total_amount, payment_amount, items_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (receipt, sale["timestamp"], sale["method"], total, total, sum(line["quantity"] for line in sale["lines"])))
+        conn.executemany("""
+            INSERT INTO sale_lines (sale_id, product_id, barcode, product_name, quantity, unit_price, line_total)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(cur.lastrowid, line["product_id"], line["barcode"], line["name"], line["quantity"],
+               line["price"], line["total_value"]) for line in sale["lines"]])
+
+
+def _migration_004_catalog_version(conn):
+    # Bumped by triggers on every catalog write (including stock changes); used as ETag for /api/products
+    conn.execute("INSERT OR IGNORE INTO sequences (name, value) VALUES ('catalog_version', 0)")
+    for table in ("products", "categories", "suppliers"):
+        for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE")):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{suffix} AFTER {event} ON {table}
+            BEGIN
+                UPDATE sequences SET value = value + 1 WHERE name = 'catalog_version';
+            END
+            """)
+
+
+def _migration_005_row_versions(conn):
+    # Every catalog row remembers the catalog_version of its last change; deletes leave a tombstone
+    for table in ("products", "categories", "suppliers"):
+        _add_column(conn, table, "row_version", "INTEGER NOT NULL DEFAULT 0")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_row_version ON {table}(row_version)")
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_deletions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,       -- products (key = barcode), categories / suppliers (key = id)
+        entity_key TEXT NOT NULL,
+        version INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_deletions_version ON catalog_deletions(version)")
+
+    bump = "UPDATE sequences SET value = value + 1 WHERE name = 'catalog_version';"
+    current = "(SELECT value FROM sequences WHERE name = 'catalog_version')"
+    for table, key in (("products", "OLD.barcode"), ("categories", "OLD.id"), ("suppliers", "OLD.id")):
+        for suffix in ("ai", "au", "ad"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_version_{suffix}")
+        conn.execute(f"""
+        CREATE TRIGGER trg_{table}_version_ai AFTER INSERT ON {table}
+        BEGIN
+            {bump}
+            UPDATE {table} SET row_version = {current} WHERE id = NEW.id;
+        END
+        """)
+        # The WHEN clause skips the row_version stamp written by the trigger itself
+        conn.execute(f"""
+        CREATE TRIGGER trg_{table}_version_au AFTER UPDATE ON {table}
+        WHEN NEW.row_version IS OLD.row_version
+        BEGIN
+            {bump}
+            UPDATE {table} SET row_version = {current} WHERE id = NEW.id;
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER trg_{table}_version_ad AFTER DELETE ON {table}
+        BEGIN
+            {bump}
+            INSERT INTO catalog_deletions (entity, entity_key, version) VALUES ('{table}', {key}, {current});
+        END
+        """)
+
+
+def _migration_006_po_order_date(conn):
+    # PO list and exports walk orders newest first; lets the joined export stream without a sort
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_po_order_date ON purchase_orders(order_date DESC, id)")
+
+
+def _migration_007_sales_rollup(conn):
+    # One row per local sale date, product and category (0 = none); analytics read this, not transactions
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS daily_sales_rollup (
+        sale_date TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        category_id INTEGER NOT NULL,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0.0,
+        cost REAL NOT NULL DEFAULT 0.0,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (sale_date, product_id, category_id)
+    ) WITHOUT ROWID
+    """)
+    # Every sale ledger row (checkout, scan-out, ...) is folded in inside the writer's transaction
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_sales_rollup AFTER INSERT ON transactions
+    WHEN NEW.transaction_type = 'sale'
+    BEGIN
+        INSERT INTO daily_sales_rollup (sale_date, product_id, category_id, units, revenue, cost, tx_count)
+        SELECT DATE(NEW.timestamp, 'localtime'), COALESCE(NEW.product_id, 0), COALESCE(p.category_id, 0),
+               NEW.quantity, COALESCE(NEW.total_value, 0), NEW.quantity * COALESCE(p.cost_price, 0), 1
+        FROM (SELECT 1) LEFT JOIN products p ON p.id = NEW.product_id
+        WHERE 1
+        ON CONFLICT (sale_date, product_id, category_id) DO UPDATE SET
+            units = units + excluded.units,
+            revenue = revenue + excluded.revenue,
+            cost = cost + excluded.cost,
+            tx_count = tx_count + 1;
+    END
+    """)
+    conn.execute("DELETE FROM daily_sales_rollup")
+    conn.execute("""
+    INSERT INTO daily_sales_rollup (sale_date, product_id, category_id, units, revenue, cost, tx_count)
+    SELECT DATE(t.timestamp, 'localtime'), COALESCE(t.product_id, 0), COALESCE(p.category_id, 0),
+           SUM(t.quantity), SUM(COALESCE(t.total_value, 0)), SUM(t.quantity * COALESCE(p.cost_price, 0)), COUNT(*)
+    FROM transactions t
+    LEFT JOIN products p ON p.id = t.product_id
+    WHERE t.transaction_type = 'sale'
+    GROUP BY 1, 2, 3
+    """)
+
+
+# Rollup rows priced at each sale's recorded unit cost (current cost only for rows without one)
+SALES_ROLLUP_REBUILD_SQL = """
+    INSERT INTO daily_sales_rollup (sale_date, product_id, category_id, units, revenue, cost, tx_count)
+    SELECT DATE(t.timestamp, 'localtime'), COALESCE(t.product_id, 0), COALESCE(p.category_id, 0),
+           SUM(t.quantity), SUM(COALESCE(t.total_value, 0)),
+           SUM(t.quantity * COALESCE(t.unit_cost, p.cost_price, 0)), COUNT(*)
+    FROM transactions_all t
+    LEFT JOIN products p ON p.id = t.product_id
+    WHERE t.transaction_type = 'sale'
+    GROUP BY 1, 2, 3
+"""
+
+
+def _migration_008_unit_cost(conn):
+    # Cost at the time of sale, so margins do not move when cost_price is edited later
+    _add_column(conn, "transactions", "unit_cost", "REAL")
+    _add_column(conn, "sale_lines", "unit_cost", "REAL")
+    # Best available figure for history: the cost price at upgrade time
+    conn.execute("""
+        UPDATE transactions
+        SET unit_cost = (SELECT cost_price FROM products WHERE products.id = transactions.product_id)
+        WHERE transaction_type = 'sale' AND unit_cost IS NULL
+    """)
+    conn.execute("""
+        UPDATE sale_lines
+        SET unit_cost = (SELECT cost_price FROM products WHERE products.id = sale_lines.product_id)
+        WHERE unit_cost IS NULL
+    """)
+    conn.execute("DROP TRIGGER IF EXISTS trg_transactions_sales_rollup")
+    conn.execute("""
+    CREATE TRIGGER trg_transactions_sales_rollup AFTER INSERT ON transactions
+    WHEN NEW.transaction_type = 'sale'
+    BEGIN
+        INSERT INTO daily_sales_rollup (sale_date, product_id, category_id, units, revenue, cost, tx_count)
+        SELECT DATE(NEW.timestamp, 'localtime'), COALESCE(NEW.product_id, 0), COALESCE(p.category_id, 0),
+               NEW.quantity, COALESCE(NEW.total_value, 0), NEW.quantity * COALESCE(NEW.unit_cost, p.cost_price, 0), 1
+        FROM (SELECT 1) LEFT JOIN products p ON p.id = NEW.product_id
+        WHERE 1
+        ON CONFLICT (sale_date, product_id, category_id) DO UPDATE SET
+            units = units + excluded.units,
+            revenue = revenue + excluded.revenue,
+            cost = cost + excluded.cost,
+            tx_count = tx_count + 1;
+    END
+    """)
+
+
+def _migration_009_ledger_version(conn):
+    # Bumped on every ledger write; with catalog_version it versions cached report results
+    conn.execute("INSERT OR IGNORE INTO sequences (name, value) VALUES ('ledger_version', 0)")
+    for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE")):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_version_{suffix} AFTER {event} ON transactions
+        BEGIN
+            UPDATE sequences SET value = value + 1 WHERE name = 'ledger_version';
+        END
+        """)
+
+
+# Whole-catalog totals recomputed from products; the triggers below keep inventory_stats equal to this
+INVENTORY_STATS_SQL = """
+    SELECT COUNT(*) AS total_products,
+           COALESCE(SUM(quantity), 0) AS total_stock,
+           COALESCE(SUM(CASE WHEN quantity <= min_stock THEN 1 ELSE 0 END), 0) AS low_stock,
+           COALESCE(SUM(quantity * cost_price), 0.0) AS total_cost,
+           COALESCE(SUM(quantity * retail_price), 0.0) AS total_retail
+    FROM products
+"""
+
+
+def _migration_010_inventory_stats(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS inventory_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_products INTEGER NOT NULL DEFAULT 0,
+        total_stock INTEGER NOT NULL DEFAULT 0,
+        low_stock INTEGER NOT NULL DEFAULT 0,
+        total_cost REAL NOT NULL DEFAULT 0.0,
+        total_retail REAL NOT NULL DEFAULT 0.0
+    )
+    """)
+    conn.execute(f"""
+        INSERT OR REPLACE INTO inventory_stats (id, total_products, total_stock, low_stock, total_cost, total_retail)
+        SELECT 1, * FROM ({INVENTORY_STATS_SQL})
+    """)
+
+    def delta(row, sign):
+        return f"""
+            total_products = total_products {sign} 1,
+            total_stock = total_stock {sign} COALESCE({row}.quantity, 0),
+            low_stock = low_stock {sign} (CASE WHEN {row}.quantity <= {row}.min_stock THEN 1 ELSE 0 END),
+            total_cost = total_cost {sign} COALESCE({row}.quantity * {row}.cost_price, 0),
+            total_retail = total_retail {sign} COALESCE({row}.quantity * {row}.retail_price, 0)
+        """
+
+    # Every sale, receiving, PO receipt, edit or delete goes through products, so it is kept here
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_stats_ai AFTER INSERT ON products
+    BEGIN
+        UPDATE inventory_stats SET {delta("NEW", "+")} WHERE id = 1;
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_stats_ad AFTER DELETE ON products
+    BEGIN
+        UPDATE inventory_stats SET {delta("OLD", "-")} WHERE id = 1;
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_stats_au
+    AFTER UPDATE OF quantity, cost_price, retail_price, min_stock ON products
+    BEGIN
+        UPDATE inventory_stats SET {delta("OLD", "-")} WHERE id = 1;
+        UPDATE inventory_stats SET {delta("NEW", "+")} WHERE id = 1;
+    END
+    """)
+
+
+def _migration_011_product_search(conn):
+    # Ranked name/description/barcode/supplier-code search; skipped on SQLite builds without FTS5
     try:
-        c.execute("ALTER TABLE purchase_orders ADD COLUMN invoice_date TEXT")
-    except Exception:
-        pass
+        conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description, barcode, supplier_code,
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 not available ({e}); product search falls back to LIKE")
+        return
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS products_fts_vocab USING fts5vocab(products_fts, 'row')")
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_ai AFTER INSERT ON products
+    BEGIN
+        INSERT INTO products_fts (rowid, name, description, barcode, supplier_code)
+        VALUES (NEW.id, NEW.name, NEW.description, NEW.barcode, NEW.supplier_code);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_ad AFTER DELETE ON products
+    BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description, barcode, supplier_code)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.barcode, OLD.supplier_code);
+    END
+    """)
+    # Stock and price updates do not touch the index
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_au
+    AFTER UPDATE OF name, description, barcode, supplier_code ON products
+    BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description, barcode, supplier_code)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.barcode, OLD.supplier_code);
+        INSERT INTO products_fts (rowid, name, description, barcode, supplier_code)
+        VALUES (NEW.id, NEW.name, NEW.description, NEW.barcode, NEW.supplier_code);
+    END
+    """)
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
+
+def _migration_012_ledger_archive(conn):
+    # Per-month archival progress; a month's archived rows count only once its status is 'done'
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ledger_archive_log (
+        month TEXT PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'copying',
+        rows INTEGER NOT NULL DEFAULT 0,
+        last_id INTEGER NOT NULL DEFAULT 0,
+        started TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished TIMESTAMP
+    )
+    """)
+    for sql in ARCHIVE_SCHEMA_SQL:
+        conn.execute(sql)
+
+
+def _migration_013_product_forecasts(conn):
+    # Suggested reorder point / quantity per product, rewritten by the forecasting job
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS product_forecasts (
+        product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+        daily_demand REAL NOT NULL DEFAULT 0,
+        demand_std REAL NOT NULL DEFAULT 0,
+        safety_stock REAL NOT NULL DEFAULT 0,
+        reorder_point INTEGER NOT NULL DEFAULT 0,
+        reorder_qty INTEGER NOT NULL DEFAULT 0,
+        method TEXT,
+        updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+
+def _migration_014_po_receipts(conn):
+    # One row per delivery against an order (several for split shipments); receipt_key makes a
+    # retried or double-clicked receive a no-op
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS po_receipts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL REFERENCES purchase_orders(id) ON DELETE CASCADE,
+        receipt_key TEXT UNIQUE,
+        invoice_number TEXT,
+        invoice_date TEXT,
+        units INTEGER NOT NULL DEFAULT 0,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS po_receipt_lines (
+        receipt_id INTEGER NOT NULL REFERENCES po_receipts(id) ON DELETE CASCADE,
+        item_id INTEGER NOT NULL,
+        product_id INTEGER,
+        quantity INTEGER NOT NULL,
+        unit_cost REAL,
+        PRIMARY KEY (receipt_id, item_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_po_receipts_order ON po_receipts(order_id)")
+    # Receiving used to leave quantity_received at 0; orders already received were received in full
+    conn.execute("""
+        UPDATE purchase_order_items SET quantity_received = quantity_ordered
+        WHERE COALESCE(quantity_received, 0) = 0
+          AND order_id IN (SELECT id FROM purchase_orders WHERE status IN ('received', 'ολοκληρωμένη'))
+    """)
+
+
+# (version, description, function) - append new steps, never renumber or edit applied ones
+MIGRATIONS = [
+    (1, "base schema", _migration_001_base_schema),
+    (2, "secondary indexes", _migration_002_indexes),
+    (3, "sales and sale_lines", _migration_003_sales),
+    (4, "catalog version triggers", _migration_004_catalog_version),
+    (5, "row versions and delete tombstones", _migration_005_row_versions),
+    (6, "purchase order date index", _migration_006_po_order_date),
+    (7, "daily sales rollup", _migration_007_sales_rollup),
+    (8, "sale-time unit cost", _migration_008_unit_cost),
+    (9, "ledger version trigger", _migration_009_ledger_version),
+    (10, "inventory stats counters", _migration_010_inventory_stats),
+    (11, "product full-text search", _migration_011_product_search),
+    (12, "ledger archive", _migration_012_ledger_archive),
+    (13, "product demand forecasts", _migration_013_product_forecasts),
+    (14, "purchase order receipts", _migration_014_po_receipts),
+]
+
+MIGRATION_LOG = []   # [{"version", "description", "ms"}] for the migrations applied at startup
+
+
+def run_migrations(conn):
+    """Apply every migration newer than PRAGMA user_version, each in its own transaction"""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"Migration {version} ({description}) failed")
+            raise
+        ms = round((time.perf_counter() - started) * 1000, 2)
+        applied.append({"version": version, "description": description, "ms": ms})
+        print(f"Migration {version} ({description}) applied in {ms} ms")
+
+    if applied:
+        conn.execute("ANALYZE")
+    MIGRATION_LOG.extend(applied)
+    return applied
+
+
+def init_database():
+    with POOL.connection() as conn:
+        applied = run_migrations(conn)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    print(f"Database initialized successfully (schema v{version}, {len(applied)} migration(s) applied)")
+    check_inventory_stats()
+
+
+def check_inventory_stats(repair=True):
+    """
+    Compare the trigger-maintained inventory_stats row with a full recount of products.
+    Rewrites the row when they differ (float drift, writes made with triggers disabled, ...).
+    """
+    with POOL.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stored = conn.execute("""
+                SELECT total_products, total_stock, low_stock, total_cost, total_retail
+                FROM inventory_stats WHERE id = 1
+            """).fetchone()
+            actual = conn.execute(INVENTORY_STATS_SQL).fetchone()
+            consistent = stored is not None and all(
+                abs((stored[key] or 0) - (actual[key] or 0)) < 0.005 for key in actual.keys()
+            )
+            if not consistent and repair:
+                conn.execute(f"""
+                    INSERT OR REPLACE INTO inventory_stats (id, total_products, total_stock, low_stock, total_cost, total_retail)
+                    SELECT 1, * FROM ({INVENTORY_STATS_SQL})
+                """)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if not consistent:
+        print(f"Inventory stats out of sync{' - rebuilt' if repair else ''}: "
+              f"stored={dict(stored) if stored else None} actual={dict(actual)}")
+    return {"consistent": consistent, "stored": dict(stored) if stored else None, "actual": dict(actual)}
+
+
+def rebuild_sales_rollup():
+    """Regenerate daily_sales_rollup from the transactions ledger; returns the number of rollup rows"""
+    with POOL.connection() as conn:
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM daily_sales_rollup")
+            conn.execute(SALES_ROLLUP_REBUILD_SQL)
+            rows = conn.execute("SELECT COUNT(*) FROM daily_sales_rollup").fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    print(f"Sales rollup rebuilt: {rows} rows in {round((time.perf_counter() - started) * 1000, 2)} ms")
+    return rows
+
+
+ARCHIVE_KEEP_MONTHS = 12     # months of ledger kept in the hot transactions table
+# Off by default: archived months live in a second file (<db>_archive.db) that backups must include.
+# Run once with --archive-ledger, or set SHOPLITE_AUTO_ARCHIVE=1 to archive at startup and daily.
+ARCHIVE_AUTO = os.environ.get("SHOPLITE_AUTO_ARCHIVE", "0") == "1"
+ARCHIVE_BATCH_ROWS = 5000    # rows copied per archive transaction
+
+
+def _archive_month(conn, month, batch_rows):
+    """
+    Copy one UTC month of ledger rows into the archive, then drop them from the hot table.
+    Progress is checkpointed in ledger_archive_log, so an interrupted run picks up where it stopped.
+    """
+    start = f"{month}-01"
+    end = _add_months(date.fromisoformat(start), 1).isoformat()
+    conn.execute("INSERT OR IGNORE INTO ledger_archive_log (month) VALUES (?)", (month,))
+    conn.commit()
+    last_id = conn.execute("SELECT last_id FROM ledger_archive_log WHERE month = ?", (month,)).fetchone()[0]
+
+    # Copy in id order, one short write transaction per batch
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            upto = conn.execute("""
+                SELECT MAX(id) FROM (
+                    SELECT id FROM main.transactions
+                    WHERE timestamp >= ? AND timestamp < ? AND id > ?
+                    ORDER BY id LIMIT ?
+                )
+            """, (start, end, last_id, batch_rows)).fetchone()[0]
+            if upto is not None:
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO archive.transactions_archive ({LEDGER_COLUMNS}, month)
+                    SELECT {LEDGER_COLUMNS}, ? FROM main.transactions
+                    WHERE timestamp >= ? AND timestamp < ? AND id > ? AND id <= ?
+                """, (month, start, end, last_id, upto))
+                conn.execute("UPDATE ledger_archive_log SET last_id = ? WHERE month = ?", (upto, month))
+                last_id = upto
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if upto is None:
+            break
+
+    # Only rows already committed to the archive are deleted, and the month becomes visible
+    # through transactions_all in the same transaction, so readers never see it twice or not at all
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        c.execute("ALTER TABLE purchase_orders ADD COLUMN date_received TEXT")
+        conn.execute("""
+            DELETE FROM main.transactions
+            WHERE timestamp >= ? AND timestamp < ?
+              AND id IN (SELECT id FROM archive.transactions_archive WHERE month = ?)
+        """, (start, end, month))
+        rows = conn.execute("SELECT COUNT(*) FROM archive.transactions_archive WHERE month = ?",
+                            (month,)).fetchone()[0]
+        conn.execute("""
+            UPDATE ledger_archive_log SET status = 'done', rows = ?, finished = CURRENT_TIMESTAMP
+            WHERE month = ?
+        """, (rows, month))
+        conn.commit()
     except Exception:
-        pass
+        conn.rollback()
+        raise
+    return rows
+
+
+def archive_ledger(keep_months=ARCHIVE_KEEP_MONTHS, batch_rows=ARCHIVE_BATCH_ROWS, vacuum=False):
+    """
+    Move closed months older than keep_months out of the hot ledger into the archive file.
+    The daily_sales_rollup keeps their aggregates; transactions_all still returns their rows.
+    Safe to interrupt and re-run. Returns {month: rows} for the months archived.
+    """
+    cutoff = _add_months(datetime.now(timezone.utc).date().replace(day=1), -keep_months).isoformat()
+    archived = {}
+    started = time.perf_counter()
+    with POOL.connection() as conn:
+        months = [row[0] for row in conn.execute("""
+            SELECT DISTINCT substr(timestamp, 1, 7) FROM transactions
+            WHERE timestamp < ? ORDER BY 1
+        """, (cutoff,))]
+        for month in months:
+            archived[month] = _archive_month(conn, month, batch_rows)
+        if vacuum and archived:
+            conn.execute("VACUUM main")
+    if archived:
+        print(f"Ledger archive: {sum(archived.values())} rows from {len(archived)} months "
+              f"in {round((time.perf_counter() - started) * 1000, 2)} ms - "
+              f"back up {POOL.archive_path} together with {POOL.path}")
+    return archived
 
-    conn.commit()
-    conn.close()
-    print("Database initialized successfully")
 
 # =========================================
 # LICENSE / TRIAL SYSTEM (LOCAL)
@@ -355,24 +1420,290 @@ def api_license_activate():
 # PRODUCTS API
 # =========================================
 
+# Fields a client may request with ?fields=... (name -> SQL expression)
+PRODUCT_LIST_FIELDS = {
+    "id": "p.id",
+    "barcode": "p.barcode",
+    "name": "p.name",
+    "description": "p.description",
+    "quantity": "p.quantity",
+    "cost_price": "p.cost_price",
+    "retail_price": "p.retail_price",
+    "min_stock": "p.min_stock",
+    "category_id": "p.category_id",
+    "supplier_id": "p.supplier_id",
+    "supplier_code": "p.supplier_code",
+    "created_date": "p.created_date",
+    "row_version": "p.row_version",
+    "category_name": "c.name",
+    "supplier_name": "s.name",
+}
+PRODUCTS_PAGE_MAX = 1000
+CATALOG_CHANGES_MAX = 5000   # above this many changed products the client is told to reload
+
+
+def _catalog_version(conn):
+    row = conn.execute("SELECT value FROM sequences WHERE name = 'catalog_version'").fetchone()
+    return row["value"] if row else 0
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    """(name, id) from a next_cursor value; ValueError if it was not produced by _encode_cursor"""
+    try:
+        last_name, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):   # bad base64 / non-ASCII / bad JSON / wrong shape
+        raise ValueError("invalid cursor")
+    if not isinstance(last_name, str) or not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise ValueError("invalid cursor")
+    return last_name, last_id
+
+
 @app.route("/api/products", methods=["GET"])
 def api_get_products():
+    """
+    Product list.
+    Without limit/cursor the whole (filtered) catalog is returned as an array, as before.
+    Query args: limit, cursor, category_id, supplier_id, low_stock=1, fields=a,b,c
+    Responses carry an ETag based on the catalog version; If-None-Match gets a 304.
+    """
     try:
-        conn = get_db_connection()
-        products = conn.execute("""
-            SELECT p.*, c.name as category_name, s.name as supplier_name 
-            FROM products p 
-            LEFT JOIN categories c ON p.category_id = c.id 
-            LEFT JOIN suppliers s ON p.supplier_id = s.id 
-            ORDER BY p.name
-        """).fetchall()
-        conn.close()
-        return jsonify([dict(product) for product in products])
+        conn = get_db()
+
+        version = _catalog_version(conn)
+        etag = f"catalog-{version}"
+        if request.if_none_match.contains_weak(etag):
+            resp = Response(status=304)
+            resp.set_etag(etag, weak=True)
+            return resp
+
+        fields = [f.strip() for f in (request.args.get('fields') or '').split(',') if f.strip()]
+        unknown = [f for f in fields if f not in PRODUCT_LIST_FIELDS]
+        if unknown:
+            return jsonify({"success": False, "message": f"Unknown fields: {', '.join(unknown)}"}), 400
+        if not fields:
+            select = "p.*, c.name as category_name, s.name as supplier_name"
+        else:
+            # name/id are needed for the cursor
+            wanted = list(dict.fromkeys(fields + ["id", "name"]))
+            select = ", ".join(f"{PRODUCT_LIST_FIELDS[f]} AS {f}" for f in wanted)
+
+        where = []
+        params = []
+        if request.args.get('category_id'):
+            where.append("p.category_id = ?")
+            params.append(int(request.args['category_id']))
+        if request.args.get('supplier_id'):
+            where.append("p.supplier_id = ?")
+            params.append(int(request.args['supplier_id']))
+        if request.args.get('low_stock') in ('1', 'true', 'yes'):
+            where.append("p.quantity <= p.min_stock")
+
+        paged = 'limit' in request.args or 'cursor' in request.args
+        if request.args.get('cursor'):
+            last_name, last_id = _decode_cursor(request.args['cursor'])
+            where.append("(p.name, p.id) > (?, ?)")
+            params.extend([last_name, last_id])
+
+        sql = f"""
+            SELECT {select}
+            FROM products p
+            LEFT JOIN categories c ON p.category_id = c.id
+            LEFT JOIN suppliers s ON p.supplier_id = s.id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY p.name, p.id
+        """
+
+        if not paged:
+            products = [dict(product) for product in conn.execute(sql, params).fetchall()]
+            if fields:
+                products = [{f: product[f] for f in fields} for product in products]
+            resp = jsonify(products)
+        else:
+            limit = min(max(int(request.args.get('limit', 100)), 1), PRODUCTS_PAGE_MAX)
+            rows = conn.execute(sql + " LIMIT ?", params + [limit + 1]).fetchall()
+            items = [dict(row) for row in rows[:limit]]
+            next_cursor = _encode_cursor([items[-1]["name"], items[-1]["id"]]) if len(rows) > limit else None
+            if fields:
+                items = [{f: item[f] for f in fields} for item in items]
+            resp = jsonify({"items": items, "next_cursor": next_cursor, "version": version})
+
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+    except (ValueError, TypeError) as e:
+        return jsonify({"success": False, "message": f"Invalid value: {str(e)}"}), 400
     except Exception as e:
         print(f"Error getting products: {e}")
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
 
+@app.route("/api/products/changes")
+def api_get_catalog_changes():
+    """
+    Catalog rows inserted/updated/deleted after ?since=<version>.
+    since=0 returns the whole catalog. When more than CATALOG_CHANGES_MAX products
+    changed, only {"reset": true} is returned and the client should sync from 0.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        conn = get_db()
+        version = _catalog_version(conn)
+
+        if since > 0 and since >= version:
+            return jsonify({"version": version, "since": since, "products": [], "categories": [],
+                            "suppliers": [], "deleted": {"products": [], "categories": [], "suppliers": []}})
+
+        # Rows untouched since the upgrade still carry row_version 0
+        floor = since if since > 0 else -1
+        limit_sql = f"LIMIT {CATALOG_CHANGES_MAX + 1}" if since > 0 else ""
+        products = conn.execute(f"""
+            SELECT p.*, c.name as category_name, s.name as supplier_name
+            FROM products p
+            LEFT JOIN categories c ON p.category_id = c.id
+            LEFT JOIN suppliers s ON p.supplier_id = s.id
+            WHERE p.row_version > ?
+            ORDER BY p.row_version
+            {limit_sql}
+        """, (floor,)).fetchall()
+        if since > 0 and len(products) > CATALOG_CHANGES_MAX:
+            return jsonify({"version": version, "since": since, "reset": True})
+
+        categories = conn.execute("SELECT * FROM categories WHERE row_version > ? ORDER BY name", (floor,)).fetchall()
+        suppliers = conn.execute("SELECT id, name, row_version FROM suppliers WHERE row_version > ? ORDER BY name",
+                                 (floor,)).fetchall()
+
+        deleted = {"products": [], "categories": [], "suppliers": []}
+        if since > 0:
+            for row in conn.execute("""
+                SELECT entity, entity_key FROM catalog_deletions WHERE version > ? ORDER BY version
+            """, (since,)):
+                key = row['entity_key'] if row['entity'] == 'products' else int(row['entity_key'])
+                deleted[row['entity']].append(key)
+
+        return jsonify({
+            "version": version,
+            "since": since,
+            "products": [dict(p) for p in products],
+            "categories": [dict(c) for c in categories],
+            "suppliers": [dict(x) for x in suppliers],
+            "deleted": deleted
+        })
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+
+SEARCH_PAGE_MAX = 100
+SEARCH_FUZZY_CUTOFF = 0.75     # difflib ratio a vocabulary term needs to replace a misspelt one
+SEARCH_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+PRODUCT_SEARCH_SELECT = """
+    SELECT p.*, c.name as category_name, s.name as supplier_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    LEFT JOIN suppliers s ON p.supplier_id = s.id
+"""
+
+
+def _has_product_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone() is not None
+
+
+def _fold(text):
+    """Lower-case without accents, for comparing typed words with indexed ones"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _fts_query(term_groups):
+    """[[alternatives for word 1], ...] -> FTS5 expression; every word must match one of its alternatives as a prefix"""
+    return " AND ".join("(" + " OR ".join(f'"{t}"*' for t in group) + ")" for group in term_groups)
+
+
+def _fuzzy_terms(conn, term):
+    """Indexed words (cut to about the typed length) close to a term, or [term] if it already prefixes one"""
+    known = conn.execute("SELECT 1 FROM products_fts_vocab WHERE term >= ? AND term < ? LIMIT 1",
+                         (term, term + "\uffff")).fetchone()
+    if known:
+        return [term]
+    folded = _fold(term)
+    candidates = {}
+    for first in {term[0], folded[0]}:
+        for row in conn.execute("SELECT term FROM products_fts_vocab WHERE term >= ? AND term < ?",
+                                (first, first + "\uffff")):
+            cut = row["term"][:len(term) + 1]
+            candidates.setdefault(_fold(cut), cut)
+    return [candidates[m] for m in difflib.get_close_matches(folded, candidates, n=3, cutoff=SEARCH_FUZZY_CUTOFF)]
+
+
+def search_products(conn, q, limit, offset):
+    """
+    (rows, fuzzy) for a free-text query, best match first.
+    Every word is matched as a prefix; when nothing matches, misspelt words are swapped for
+    close indexed words. Without FTS5 falls back to a LIKE scan ordered by name.
+    """
+    terms = [t.lower() for t in SEARCH_TERM_RE.findall(q)]
+    if not terms:
+        return [], False
+
+    if not _has_product_fts(conn):
+        where = " AND ".join("(p.name LIKE ? OR p.barcode LIKE ? OR p.supplier_code LIKE ?)" for _ in terms)
+        params = [f"%{t}%" for t in terms for _ in range(3)]
+        rows = conn.execute(f"{PRODUCT_SEARCH_SELECT} WHERE {where} ORDER BY p.name LIMIT ? OFFSET ?",
+                            params + [limit, offset]).fetchall()
+        return rows, False
+
+    # Name hits rank above barcode / supplier code hits, description hits last
+    ranked_sql = f"""
+        {PRODUCT_SEARCH_SELECT}
+        JOIN (
+            SELECT rowid, bm25(products_fts, 10.0, 1.0, 5.0, 3.0) AS score
+            FROM products_fts WHERE products_fts MATCH ?
+        ) m ON m.rowid = p.id
+        ORDER BY m.score, p.name
+        LIMIT ? OFFSET ?
+    """
+    exact = _fts_query([[t] for t in terms])
+    rows = conn.execute(ranked_sql, (exact, limit, offset)).fetchall()
+    if rows:
+        return rows, False
+    # Past the end of an exact result, or no exact match at all (then every page is fuzzy)
+    if offset and conn.execute("SELECT 1 FROM products_fts WHERE products_fts MATCH ? LIMIT 1", (exact,)).fetchone():
+        return rows, False
+
+    groups = [_fuzzy_terms(conn, t) for t in terms]
+    if not all(groups):
+        return [], True
+    return conn.execute(ranked_sql, (_fts_query(groups), limit, offset)).fetchall(), True
+
+
+@app.route("/api/products/search")
+def api_search_products():
+    """Ranked product search: ?q=<words>&limit=&offset= (prefix matching, typo-tolerant fallback)"""
+    try:
+        q = (request.args.get('q') or '').strip()
+        limit = min(max(int(request.args.get('limit', 20)), 1), SEARCH_PAGE_MAX)
+        offset = max(int(request.args.get('offset', 0)), 0)
+
+        conn = get_db()
+        rows, fuzzy = search_products(conn, q, limit + 1, offset)
+
+        return jsonify({
+            "success": True,
+            "query": q,
+            "products": [dict(r) for r in rows[:limit]],
+            "limit": limit,
+            "offset": offset,
+            "has_more": len(rows) > limit,
+            "fuzzy": fuzzy
+        })
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+
 @app.route("/api/products", methods=["POST"])
 def api_add_product():
     try:
@@ -386,12 +1717,11 @@ def api_add_product():
             if not data.get(field):
                 return jsonify({"success": False, "message": f"Field {field} is required"}), 400
 
-        conn = get_db_connection()
+        conn = get_db()
 
         # Check if barcode already exists
         existing = conn.execute("SELECT id FROM products WHERE barcode = ?", (data['barcode'],)).fetchone()
         if existing:
-            conn.close()
             return jsonify({"success": False, "message": "A product with this barcode already exists"}), 400
 
         # Add new product
@@ -414,7 +1744,8 @@ def api_add_product():
         ))
 
         conn.commit()
-        conn.close()
+        CATALOG.invalidate(data['barcode'].strip())
+        EVENTS.publish("catalog", {"action": "added", "barcode": data['barcode'].strip()})
         return jsonify({"success": True, "message": "Product added successfully"})
 
     except Exception as e:
@@ -426,20 +1757,12 @@ def api_add_product():
 def api_get_product(barcode):
     """Get specific product"""
     try:
-        conn = get_db_connection()
-        product = conn.execute("""
-            SELECT p.*, c.name as category_name, s.name as supplier_name 
-            FROM products p 
-            LEFT JOIN categories c ON p.category_id = c.id 
-            LEFT JOIN suppliers s ON p.supplier_id = s.id 
-            WHERE p.barcode = ?
-        """, (barcode,)).fetchone()
-        conn.close()
+        product = CATALOG.get(get_db(), barcode)
 
         if not product:
             return jsonify({"success": False, "message": "Product not found"}), 404
 
-        return jsonify({"success": True, "product": dict(product)})
+        return jsonify({"success": True, "product": product})
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
@@ -450,12 +1773,11 @@ def api_update_product(barcode):
     try:
         data = request.get_json()
 
-        conn = get_db_connection()
+        conn = get_db()
 
         # Check if product exists
         product = conn.execute("SELECT id FROM products WHERE barcode = ?", (barcode,)).fetchone()
         if not product:
-            conn.close()
             return jsonify({"success": False, "message": "Product not found"}), 404
 
         # Update product
@@ -479,7 +1801,8 @@ def api_update_product(barcode):
         ))
 
         conn.commit()
-        conn.close()
+        CATALOG.invalidate(barcode)
+        EVENTS.publish("catalog", {"action": "updated", "barcode": barcode})
 
         return jsonify({"success": True, "message": "Product updated successfully"})
 
@@ -492,18 +1815,18 @@ def api_update_product(barcode):
 def api_delete_product(barcode):
     """Delete product"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
         # Check if product exists
         product = conn.execute("SELECT id FROM products WHERE barcode = ?", (barcode,)).fetchone()
         if not product:
-            conn.close()
             return jsonify({"success": False, "message": "Product not found"}), 404
 
         # Delete product
         conn.execute("DELETE FROM products WHERE barcode = ?", (barcode,))
         conn.commit()
-        conn.close()
+        CATALOG.invalidate(barcode)
+        EVENTS.publish("catalog", {"action": "deleted", "barcode": barcode})
 
         return jsonify({"success": True, "message": "Product deleted successfully"})
 
@@ -519,9 +1842,8 @@ def api_delete_product(barcode):
 def api_get_categories():
     """Get all categories"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
         categories = conn.execute("SELECT * FROM categories ORDER BY name").fetchall()
-        conn.close()
         return jsonify([dict(category) for category in categories])
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
@@ -537,18 +1859,16 @@ def api_add_category():
         if not name:
             return jsonify({"success": False, "message": "Category name is required"}), 400
 
-        conn = get_db_connection()
+        conn = get_db()
 
         # Check if category already exists
         existing = conn.execute("SELECT id FROM categories WHERE name = ?", (name,)).fetchone()
         if existing:
-            conn.close()
             return jsonify({"success": False, "message": "Category with this name already exists"}), 400
 
         # Add new category
         conn.execute("INSERT INTO categories (name) VALUES (?)", (name,))
         conn.commit()
-        conn.close()
 
         return jsonify({"success": True, "message": "Category added successfully"})
 
@@ -560,20 +1880,20 @@ def api_add_category():
 def api_delete_category(category_id):
     """Delete category"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
         # Check if category has products
         products_count = conn.execute(
             "SELECT COUNT(*) as count FROM products WHERE category_id = ?", (category_id,)
         ).fetchone()['count']
         if products_count > 0:
-            conn.close()
             return jsonify({"success": False, "message": "You cannot delete a category that contains products"}), 400
 
         # Delete category
         conn.execute("DELETE FROM categories WHERE id = ?", (category_id,))
         conn.commit()
-        conn.close()
+        CATALOG.clear()
+        EVENTS.publish("catalog", {"action": "category_deleted", "category_id": category_id})
 
         return jsonify({"success": True, "message": "Category deleted successfully"})
 
@@ -583,78 +1903,58 @@ def api_delete_category(category_id):
 
 @app.route("/api/purchase-orders/<int:order_id>", methods=["DELETE"])
 def delete_purchase_order(order_id):
-    import sqlite3
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
     row = cur.execute("SELECT status FROM purchase_orders WHERE id=?", (order_id,)).fetchone()
     if not row:
-        conn.close()
         return jsonify({"success": False, "error": "Purchase order not found"}), 404
 
     # Protection: do not delete orders that have been received
-    if (row["status"] or "").lower() in ("received", "ολοκληρωμένη"):
-        conn.close()
+    if (row["status"] or "").lower() in ("received", "partial", "ολοκληρωμένη"):
         return jsonify({"success": False, "error": "The purchase order has been received and cannot be deleted"}), 400
 
     cur.execute("DELETE FROM purchase_order_items WHERE order_id=?", (order_id,))
     cur.execute("DELETE FROM purchase_orders WHERE id=?", (order_id,))
     conn.commit()
-    conn.close()
     return jsonify({"success": True})
 
 
 @app.route("/api/export/purchase-orders", methods=["GET"])
 def export_purchase_orders():
-    import csv, io, sqlite3
-    from flask import Response
-
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    rows = cur.execute("""
-        SELECT 
-            po.id,
-            po.order_date,
-            po.status,
-            po.total_amount,
-            po.invoice_number,
-            po.invoice_date,
-            po.date_received,
-            s.name AS supplier_name
-        FROM purchase_orders po
-        LEFT JOIN suppliers s ON s.id = po.supplier_id
-        ORDER BY po.id DESC
-    """).fetchall()
-    conn.close()
-
-    # Write to StringIO and use UTF-8 BOM (utf-8-sig) for proper Excel import on Windows
-    output = io.StringIO(newline="")
-    writer = csv.writer(output)
-    writer.writerow([
+    def rows():
+        for r in _stream_query("""
+            SELECT 
+                po.id,
+                po.order_date,
+                po.status,
+                po.total_amount,
+                po.invoice_number,
+                po.invoice_date,
+                po.date_received,
+                s.name AS supplier_name
+            FROM purchase_orders po
+            LEFT JOIN suppliers s ON s.id = po.supplier_id
+            ORDER BY po.id DESC
+        """):
+            yield [
+                r["id"],
+                r["supplier_name"],
+                r["order_date"],
+                r["status"],
+                ("%.2f" % (r["total_amount"] or 0)),
+                r["invoice_number"] or "",
+                r["invoice_date"] or "",
+                r["date_received"] or "",
+            ]
+
+    header = [
         "id", "supplier", "order_date", "status",
         "total_amount", "invoice_number", "invoice_date", "date_received"
-    ])
-    for r in rows:
-        writer.writerow([
-            r["id"],
-            r["supplier_name"],
-            r["order_date"],
-            r["status"],
-            ("%.2f" % (r["total_amount"] or 0)),
-            r["invoice_number"] or "",
-            r["invoice_date"] or "",
-            r["date_received"] or "",
-        ])
-
-    csv_text = output.getvalue()
-    # Add BOM
-    csv_bytes = csv_text.encode("utf-8-sig")
-
+    ]
+    # UTF-8 BOM for proper Excel import on Windows
     return Response(
-        csv_bytes,
+        _stream_csv(header, rows(), bom=True),
         mimetype="application/octet-stream",
         headers={
             'X-Content-Type-Options': 'nosniff',
@@ -668,20 +1968,20 @@ def export_purchase_orders():
 def api_delete_supplier(supplier_id):
     """Delete supplier"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
         # Check if there are products with this supplier
         products_count = conn.execute(
             "SELECT COUNT(*) as count FROM products WHERE supplier_id = ?", (supplier_id,)
         ).fetchone()['count']
         if products_count > 0:
-            conn.close()
             return jsonify({"success": False, "message": "You cannot delete a supplier that has products"}), 400
 
         # Delete supplier
         conn.execute("DELETE FROM suppliers WHERE id = ?", (supplier_id,))
         conn.commit()
-        conn.close()
+        CATALOG.clear()
+        EVENTS.publish("catalog", {"action": "supplier_deleted", "supplier_id": supplier_id})
 
         return jsonify({"success": True, "message": "Supplier deleted successfully"})
 
@@ -702,39 +2002,31 @@ def api_quick_add_stock():
         if not barcode:
             return jsonify({"success": False, "message": "Barcode is required"}), 400
 
-        conn = get_db_connection()
+        conn = get_db()
 
         # Find product
-        product = conn.execute("""
-            SELECT p.*, s.name as supplier_name, c.name as category_name 
-            FROM products p 
-            LEFT JOIN suppliers s ON p.supplier_id = s.id 
-            LEFT JOIN categories c ON p.category_id = c.id 
-            WHERE p.barcode = ?
-        """, (barcode,)).fetchone()
+        product = CATALOG.get(conn, barcode)
 
         if not product:
-            conn.close()
             return jsonify({"success": False, "message": f"Product with barcode {barcode} not found"}), 404
 
         # Update quantity
-        conn.execute("UPDATE products SET quantity = quantity + ? WHERE barcode = ?", (quantity, barcode))
+        conn.execute("UPDATE products SET quantity = quantity + ? WHERE id = ?", (quantity, product['id']))
+        new_quantity = conn.execute("SELECT quantity FROM products WHERE id = ?", (product['id'],)).fetchone()['quantity']
 
         # Log transaction
-        conn.execute("""
-            INSERT INTO transactions (product_id, barcode, transaction_type, quantity, price, total_value, notes)
-            VALUES (?, ?, 'receiving', ?, ?, ?, ?)
-        """, (
-            product['id'],
-            barcode,
-            quantity,
-            product['cost_price'],
-            product['cost_price'] * quantity,
-            f"Quick receiving - {quantity} units"
-        ))
+        _insert_ledger(conn, [{
+            "product_id": product['id'],
+            "barcode": barcode,
+            "transaction_type": "receiving",
+            "quantity": quantity,
+            "price": product['cost_price'],
+            "total_value": product['cost_price'] * quantity,
+            "notes": f"Quick receiving - {quantity} units"
+        }])
 
         conn.commit()
-        conn.close()
+        publish_stock_changes([(product, new_quantity)])
 
         return jsonify({
             "success": True,
@@ -758,37 +2050,37 @@ def api_scan_out():
         if not barcode:
             return jsonify({"success": False, "message": "Barcode is required"}), 400
 
-        conn = get_db_connection()
+        conn = get_db()
 
         # Find product
-        product = conn.execute("SELECT * FROM products WHERE barcode = ?", (barcode,)).fetchone()
+        product = CATALOG.get(conn, barcode)
         if not product:
-            conn.close()
             return jsonify({"success": False, "message": f"Product with barcode {barcode} not found"}), 404
 
-        # Check stock
-        if product['quantity'] < quantity:
-            conn.close()
+        # Check stock and update quantity in one statement
+        cur = conn.execute(
+            "UPDATE products SET quantity = quantity - ? WHERE id = ? AND quantity >= ?",
+            (quantity, product['id'], quantity)
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
             return jsonify({"success": False, "message": "Insufficient stock"}), 400
-
-        # Update quantity
-        conn.execute("UPDATE products SET quantity = quantity - ? WHERE barcode = ?", (quantity, barcode))
+        new_quantity = conn.execute("SELECT quantity FROM products WHERE id = ?", (product['id'],)).fetchone()['quantity']
 
         # Log transaction
-        conn.execute("""
-            INSERT INTO transactions (product_id, barcode, transaction_type, quantity, price, total_value, notes)
-            VALUES (?, ?, 'sale', ?, ?, ?, ?)
-        """, (
-            product['id'],
-            barcode,
-            quantity,
-            product['retail_price'],
-            product['retail_price'] * quantity,
-            f"Stock removal - {quantity} units"
-        ))
+        _insert_ledger(conn, [{
+            "product_id": product['id'],
+            "barcode": barcode,
+            "transaction_type": "sale",
+            "quantity": quantity,
+            "price": product['retail_price'],
+            "total_value": product['retail_price'] * quantity,
+            "notes": f"Stock removal - {quantity} units",
+            "unit_cost": product['cost_price']
+        }])
 
         conn.commit()
-        conn.close()
+        publish_stock_changes([(product, new_quantity)])
 
         return jsonify({
             "success": True,
@@ -800,6 +2092,161 @@ def api_scan_out():
         print(f"Error in scan out: {e}")
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
+SCAN_BATCH_MAX = 1000   # lines accepted per /api/scan/batch call
+
+
+@app.route("/api/scan/batch", methods=["POST"])
+def api_scan_batch():
+    """
+    Apply many buffered scans in one transaction.
+    Body: {"mode": "in" | "out", "items": [{"barcode", "quantity", "mode"?}, ...]}
+    "in" receives stock (like quick-add), "out" removes it (like scan-out). Lines are applied in
+    order; a line that fails (unknown barcode, not enough stock) is reported and skipped.
+    """
+    try:
+        data = request.get_json() or {}
+        default_mode = data.get('mode', 'in')
+        items = data.get('items') or []
+        if not items:
+            return jsonify({"success": False, "message": "No scans received"}), 400
+        if len(items) > SCAN_BATCH_MAX:
+            return jsonify({"success": False, "message": f"At most {SCAN_BATCH_MAX} scans per batch"}), 400
+
+        lines = []
+        for item in items:
+            try:
+                quantity = int(item.get('quantity', 1))
+            except (TypeError, ValueError):
+                quantity = 0
+            lines.append({
+                "barcode": str(item.get('barcode') or '').strip(),
+                "quantity": quantity,
+                "mode": item.get('mode') or default_mode
+            })
+
+        conn = get_db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            products = _fetch_products_by_barcodes(conn, {line["barcode"] for line in lines if line["barcode"]})
+            stock = {bc: row['quantity'] for bc, row in products.items()}
+            results, ledger = [], []
+
+            for line in lines:
+                barcode, quantity, mode = line["barcode"], line["quantity"], line["mode"]
+                product = products.get(barcode)
+                if mode not in ('in', 'out'):
+                    results.append({"barcode": barcode, "success": False, "message": "mode must be in or out"})
+                    continue
+                if not barcode or quantity <= 0:
+                    results.append({"barcode": barcode, "success": False, "message": "Invalid barcode or quantity"})
+                    continue
+                if product is None:
+                    results.append({"barcode": barcode, "success": False,
+                                    "message": f"Product with barcode {barcode} not found"})
+                    continue
+                if mode == 'out' and stock[barcode] < quantity:
+                    results.append({"barcode": barcode, "success": False, "product_name": product['name'],
+                                    "message": "Insufficient stock"})
+                    continue
+
+                stock[barcode] += quantity if mode == 'in' else -quantity
+                if mode == 'in':
+                    ledger.append({
+                        "product_id": product['id'], "barcode": barcode, "transaction_type": "receiving",
+                        "quantity": quantity, "price": product['cost_price'],
+                        "total_value": product['cost_price'] * quantity,
+                        "notes": f"Quick receiving - {quantity} units"
+                    })
+                else:
+                    ledger.append({
+                        "product_id": product['id'], "barcode": barcode, "transaction_type": "sale",
+                        "quantity": quantity, "price": product['retail_price'],
+                        "total_value": product['retail_price'] * quantity,
+                        "notes": f"Stock removal - {quantity} units", "unit_cost": product['cost_price']
+                    })
+                results.append({"barcode": barcode, "success": True, "product_name": product['name'],
+                                "mode": mode, "quantity": quantity, "stock": stock[barcode]})
+
+            # Net change per product in one executemany; the lock taken above makes the totals exact
+            changed = [(stock[bc] - row['quantity'], row['id']) for bc, row in products.items()
+                       if stock[bc] != row['quantity']]
+            conn.executemany("UPDATE products SET quantity = quantity + ? WHERE id = ?", changed)
+            if ledger:
+                _insert_ledger(conn, ledger)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        publish_stock_changes([(row, stock[bc]) for bc, row in products.items() if stock[bc] != row['quantity']])
+
+        applied = sum(1 for r in results if r["success"])
+        return jsonify({
+            "success": True,
+            "applied": applied,
+            "failed": len(results) - applied,
+            "results": results
+        })
+
+    except Exception as e:
+        print(f"Error in scan batch: {e}")
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+# =========================================
+# DATE RANGE HELPERS
+# =========================================
+# Ledger timestamps are stored in UTC (CURRENT_TIMESTAMP); reports are asked for in the shop's
+# local time. Periods resolve to half-open [start, end) local dates, then to UTC timestamp bounds,
+# so filters stay plain comparisons on the indexed column and days break at local midnight.
+
+def _add_months(day, months):
+    """Same day of month `months` later (negative = earlier), clamped to the month's last day"""
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    next_month = datetime(year + month // 12, month % 12 + 1, 1).date()
+    return day.replace(year=year, month=month, day=min(day.day, (next_month - timedelta(days=1)).day))
+
+
+def local_date_range(period, today=None):
+    """(start, end) local dates for a named period; end is exclusive"""
+    today = today or datetime.now().date()
+    tomorrow = today + timedelta(days=1)
+    if period == "today":
+        return today, tomorrow
+    if period == "yesterday":
+        return today - timedelta(days=1), today
+    if period == "this_month":
+        return today.replace(day=1), _add_months(today.replace(day=1), 1)
+    if period == "this_year":
+        return today.replace(month=1, day=1), today.replace(year=today.year + 1, month=1, day=1)
+    if period == "last_year":
+        return today.replace(year=today.year - 1, month=1, day=1), today.replace(month=1, day=1)
+    if period.startswith("last_") and period.endswith("_days"):
+        return today - timedelta(days=int(period[5:-5])), tomorrow
+    if period.startswith("last_") and period.endswith("_months"):
+        return _add_months(today, -int(period[5:-7])), tomorrow
+    raise ValueError(f"Unknown period: {period}")
+
+
+def utc_bounds(start, end):
+    """Local dates [start, end) -> UTC 'YYYY-MM-DD HH:MM:SS' bounds comparable with ledger timestamps"""
+    def to_utc(day):
+        local_midnight = datetime(day.year, day.month, day.day).astimezone()
+        return local_midnight.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return to_utc(start), to_utc(end)
+
+
+def period_bounds(period, today=None):
+    """UTC timestamp bounds for a named period (see local_date_range)"""
+    return utc_bounds(*local_date_range(period, today))
+
+
+def period_dates(period, today=None):
+    """'YYYY-MM-DD' bounds for a named period, for tables keyed by local date (daily_sales_rollup)"""
+    start, end = local_date_range(period, today)
+    return start.isoformat(), end.isoformat()
+
 # =========================================
 # STATISTICS API
 # =========================================
@@ -808,18 +2255,19 @@ def api_scan_out():
 def api_get_stats():
     """System statistics"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
-        # Basic stats
+        # Basic stats (single row kept current by triggers on products)
         stats = conn.execute("""
             SELECT 
-                COUNT(*) as total_products,
-                SUM(quantity) as total_stock,
-                SUM(CASE WHEN quantity <= min_stock THEN 1 ELSE 0 END) as low_stock,
-                SUM(quantity * cost_price) as total_cost,
-                SUM(quantity * retail_price) as total_retail,
-                SUM(quantity * (retail_price - cost_price)) as total_profit
-            FROM products
+                total_products,
+                total_stock,
+                low_stock,
+                total_cost,
+                total_retail,
+                total_retail - total_cost as total_profit
+            FROM inventory_stats
+            WHERE id = 1
         """).fetchone()
 
         # Today's transactions from transactions table (sales only)
@@ -827,11 +2275,10 @@ def api_get_stats():
             SELECT COUNT(*) AS cnt
             FROM transactions
             WHERE transaction_type = 'sale'
-              AND DATE(timestamp) = DATE('now','localtime')
-        """).fetchone()
+              AND timestamp >= ? AND timestamp < ?
+        """, period_bounds("today")).fetchone()
         today_transactions = int(today_tx_row["cnt"] if today_tx_row and today_tx_row["cnt"] is not None else 0)
 
-        conn.close()
 
         return jsonify({
             "total_products": stats['total_products'] or 0,
@@ -847,6 +2294,282 @@ def api_get_stats():
         print(f"Error getting stats: {e}")
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
+
+@app.route("/api/events")
+def api_events():
+    """SSE stream: stock, low_stock, sale, po_received, catalog, resync"""
+    subscriber = EVENTS.subscribe()
+    if subscriber is None:
+        return jsonify({"success": False, "message": "Too many open event streams"}), 503
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            deadline = time.monotonic() + SSE_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event, data = subscriber.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            EVENTS.unsubscribe(subscriber)
+
+    resp = Response(stream(), mimetype="text/event-stream", headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # The generator's finally never runs if the body is not iterated (HEAD, early disconnect);
+    # closing the response always frees the slot
+    resp.call_on_close(lambda: EVENTS.unsubscribe(subscriber))
+    return resp
+
+
+@app.route("/api/system/metrics")
+def api_system_metrics():
+    """Internal performance counters (connection pool, caches, queues)"""
+    schema_version = get_db().execute("PRAGMA user_version").fetchone()[0]
+    return jsonify({
+        "db_pool": POOL.stats(),
+        "catalog_cache": CATALOG.stats(),
+        "analytics_cache": ANALYTICS_CACHE.stats(),
+        "events": EVENTS.stats(),
+        "ledger_writer": LEDGER.stats(),
+        "ledger_archive": dict(get_db().execute("""
+            SELECT COUNT(*) AS months, COALESCE(SUM(rows), 0) AS rows, MAX(month) AS latest
+            FROM ledger_archive_log WHERE status = 'done'
+        """).fetchone()),
+        "schema": {"version": schema_version, "migrations": MIGRATION_LOG}
+    })
+
+# =========================================
+# STOCK & LEDGER HELPERS
+# =========================================
+SQL_VARIABLE_CHUNK = 500   # stay well below SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+
+
+def _chunks(items, size=SQL_VARIABLE_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _fetch_products_by_barcodes(conn, barcodes):
+    """{barcode: row} for all given barcodes, fetched with IN (...) batches instead of one query per line"""
+    found = {}
+    for chunk in _chunks(barcodes):
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(f"""
+            SELECT id, barcode, name, quantity, min_stock, cost_price, retail_price
+            FROM products
+            WHERE barcode IN ({placeholders})
+        """, chunk):
+            found[row['barcode']] = row
+    return found
+
+
+def _next_sequence(conn, name):
+    """Next value of a named counter; call inside the write transaction that uses it"""
+    conn.execute("UPDATE sequences SET value = value + 1 WHERE name = ?", (name,))
+    return conn.execute("SELECT value FROM sequences WHERE name = ?", (name,)).fetchone()["value"]
+
+
+LEDGER_INSERT_SQL = """
+    INSERT INTO transactions (product_id, barcode, transaction_type, quantity, price, total_value, notes, unit_cost,
+                              timestamp)
+    VALUES (:product_id, :barcode, :transaction_type, :quantity, :price, :total_value, :notes, :unit_cost,
+            COALESCE(:timestamp, CURRENT_TIMESTAMP))
+"""
+
+
+def _insert_ledger(conn, rows):
+    """
+    Append rows (dicts) to the transactions ledger with a single executemany; unit_cost is optional.
+    In group-commit mode the rows are stamped now and written by LEDGER once conn commits.
+    """
+    rows = [{"unit_cost": None, "timestamp": None, **row} for row in rows]
+    if LEDGER.enabled:
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        for row in rows:
+            row["timestamp"] = row["timestamp"] or now
+        conn._deferred_ledger = (*conn._deferred_ledger, *rows)
+        return
+    conn.executemany(LEDGER_INSERT_SQL, rows)
+
+
+LEDGER_GROUP_COMMIT = os.environ.get("SHOPLITE_GROUP_COMMIT", "0") == "1"
+LEDGER_FLUSH_MS = 50        # longest a queued ledger row waits before its batch is committed
+LEDGER_FLUSH_ROWS = 500     # or fewer, once this many rows are queued
+LEDGER_DRAIN_ATTEMPTS = 5   # write attempts per batch once stopping, so shutdown cannot hang
+LEDGER_DEAD_LETTER_FILE = os.path.join(USER_FOLDER, "ledger_dead_letter.jsonl")   # rows that could not be written
+
+
+class LedgerWriter:
+    """
+    Optional write-behind for ledger rows (SHOPLITE_GROUP_COMMIT=1).
+    Stock changes stay in the request's own transaction; the matching transactions rows are
+    queued after that commit and written by one thread, many requests per commit.
+    Ledger-derived figures (sales rollup, analytics) trail by at most about LEDGER_FLUSH_MS.
+    A row whose product was deleted before the flush is written with product_id NULL (as ON DELETE
+    SET NULL would have done); a row that still fails is appended to LEDGER_DEAD_LETTER_FILE.
+    """
+
+    def __init__(self, enabled, flush_ms=LEDGER_FLUSH_MS, flush_rows=LEDGER_FLUSH_ROWS):
+        self.enabled = enabled
+        self.flush_ms = flush_ms
+        self.flush_rows = flush_rows
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.dead_lettered = 0
+        self.max_depth = 0
+        self.last_batch_ms = 0.0
+
+    def enqueue(self, rows):
+        with self._lock:
+            if (self._thread is None or not self._thread.is_alive()) and not self._stopping:
+                self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+                self._thread.start()
+            self.enqueued += len(rows)
+        for row in rows:
+            self._queue.put(row)
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        if self._stopping:
+            while not self._queue.empty():
+                self._write(self._take(block=False), LEDGER_DRAIN_ATTEMPTS)
+
+    def _take(self, block=True):
+        """Next batch: waits for a first row, then collects until flush_rows or flush_ms"""
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=0.5) if block else self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_ms / 1000
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if block and remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch, max_attempts=None):
+        """Write a batch in one transaction; transient errors are retried (max_attempts times if given)"""
+        attempts = 0
+        while batch:
+            started = time.perf_counter()
+            try:
+                with POOL.connection() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        conn.execute("SAVEPOINT ledger_batch")
+                        try:
+                            conn.executemany(LEDGER_INSERT_SQL, batch)
+                            written, failed = len(batch), []
+                        except sqlite3.IntegrityError:
+                            # executemany stops at the bad row; undo the rows before it and go one by one
+                            conn.execute("ROLLBACK TO ledger_batch")
+                            written, failed = self._write_rows(conn, batch)
+                        conn.execute("RELEASE ledger_batch")
+                        sqlite3.Connection.commit(conn)
+                    except Exception:
+                        sqlite3.Connection.rollback(conn)
+                        raise
+            except sqlite3.Error as e:
+                # Keep the rows and retry: the ledger must not lose entries for committed stock changes
+                self.errors += 1
+                attempts += 1
+                print(f"Ledger writer error ({len(batch)} rows pending): {e}")
+                if max_attempts is not None and attempts >= max_attempts:
+                    self._dead_letter(batch, e)
+                    return
+                time.sleep(0.5)
+                continue
+            for row, error in failed:
+                self._dead_letter([row], error)
+            self.written += written
+            self.batches += 1
+            self.last_batch_ms = round((time.perf_counter() - started) * 1000, 2)
+            return
+
+    def _write_rows(self, conn, batch):
+        """
+        Row-by-row fallback after a constraint error, inside the caller's transaction.
+        Returns (rows written, [(row, error)] for rows that cannot be written).
+        """
+        written, failed = 0, []
+        for row in batch:
+            try:
+                conn.execute(LEDGER_INSERT_SQL, row)
+                written += 1
+                continue
+            except sqlite3.IntegrityError as e:
+                error = e
+            if row["product_id"] is not None:
+                try:
+                    conn.execute(LEDGER_INSERT_SQL, {**row, "product_id": None})
+                    written += 1
+                    continue
+                except sqlite3.IntegrityError as e:
+                    error = e
+            failed.append((row, error))
+        return written, failed
+
+    def _dead_letter(self, rows, error):
+        self.dead_lettered += len(rows)
+        print(f"Ledger writer: {len(rows)} row(s) could not be written ({error}), "
+              f"saved to {LEDGER_DEAD_LETTER_FILE}")
+        try:
+            with open(LEDGER_DEAD_LETTER_FILE, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({**row, "error": str(error)}) + "\n")
+        except OSError as e:
+            print("Ledger writer: dead-letter file error:", e)
+
+    def _run(self):
+        while not self._stopping:
+            batch = self._take()
+            try:
+                self._write(batch)
+            except Exception as e:
+                # Anything but an SQLite error would otherwise end the thread with rows still queued
+                self.errors += 1
+                self._dead_letter(batch, e)
+
+    def drain(self):
+        """Stop the thread and write everything still queued (called at exit)"""
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        while not self._queue.empty():
+            self._write(self._take(block=False), LEDGER_DRAIN_ATTEMPTS)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "depth": self._queue.qsize(),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "avg_batch_rows": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "last_batch_ms": self.last_batch_ms,
+            "errors": self.errors,
+            "dead_lettered": self.dead_lettered
+        }
+
+
+LEDGER = LedgerWriter(LEDGER_GROUP_COMMIT)
+atexit.register(LEDGER.drain)
+
 # =========================================
 # POS SYSTEM API
 # =========================================
@@ -862,31 +2585,19 @@ def api_pos_add_to_cart():
         if not barcode:
             return jsonify({"success": False, "message": "Barcode is required"}), 400
 
-        conn = get_db_connection()
-
         # Find product
-        product = conn.execute("""
-            SELECT p.*, s.name as supplier_name, c.name as category_name 
-            FROM products p 
-            LEFT JOIN suppliers s ON p.supplier_id = s.id 
-            LEFT JOIN categories c ON p.category_id = c.id 
-            WHERE p.barcode = ?
-        """, (barcode,)).fetchone()
+        product = CATALOG.get(get_db(), barcode)
 
         if not product:
-            conn.close()
             return jsonify({"success": False, "message": f"Product with barcode {barcode} not found"}), 404
 
         # Check stock
         if product['quantity'] < quantity:
-            conn.close()
             return jsonify({"success": False, "message": "Insufficient stock"}), 400
 
-        conn.close()
-
         return jsonify({
             "success": True,
-            "product": dict(product)
+            "product": product
         })
 
     except Exception as e:
@@ -896,7 +2607,7 @@ def api_pos_add_to_cart():
 
 @app.route("/api/pos/complete-sale", methods=["POST"])
 def api_pos_complete_sale():
-    """Complete POS sale"""
+    """Complete POS sale (whole cart in one write transaction)"""
     try:
         data = request.get_json()
         cart_items = data.get('cart_items', [])
@@ -907,141 +2618,263 @@ def api_pos_complete_sale():
         if not cart_items:
             return jsonify({"success": False, "message": "Cart is empty"}), 400
 
-        conn = get_db_connection()
-
-        # Create unique receipt number
-        receipt_number = f"R{int(datetime.now().timestamp())}"
-
-        # Process each product in cart
+        # Merge repeated barcodes so every product is checked and decremented once
+        wanted = {}
         for item in cart_items:
-            barcode = item.get('barcode')
+            barcode = (item.get('barcode') or '').strip()
             quantity = int(item.get('quantity', 1))
+            if not barcode or quantity <= 0:
+                return jsonify({"success": False, "message": "Invalid cart line"}), 400
+            wanted[barcode] = wanted.get(barcode, 0) + quantity
 
-            # Find product
-            product = conn.execute("SELECT * FROM products WHERE barcode = ?", (barcode,)).fetchone()
-            if not product:
-                continue
-
-            # Check stock
-            if product['quantity'] < quantity:
-                conn.close()
-                return jsonify({"success": False, "message": f"Insufficient stock for: {product['name']}"}), 400
-
-            # Update quantity
-            conn.execute("UPDATE products SET quantity = quantity - ? WHERE barcode = ?", (quantity, barcode))
+        conn = get_db()
 
-            # Log sale transaction
-            conn.execute("""
-                INSERT INTO transactions (product_id, barcode, transaction_type, quantity, price, total_value, notes)
-                VALUES (?, ?, 'sale', ?, ?, ?, ?)
-            """, (
-                product['id'],
-                barcode,
-                quantity,
-                product['retail_price'],
-                product['retail_price'] * quantity,
-                f"POS Sale - Receipt: {receipt_number} - {payment_method}"
-            ))
+        # Take the write lock before reading stock, so two registers cannot both pass the check
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            products = _fetch_products_by_barcodes(conn, wanted)
+
+            missing = [bc for bc in wanted if bc not in products]
+            if missing:
+                conn.rollback()
+                return jsonify({"success": False, "message": f"Product not found: {', '.join(missing)}"}), 400
+
+            for bc, qty in wanted.items():
+                if products[bc]['quantity'] < qty:
+                    conn.rollback()
+                    return jsonify({"success": False, "message": f"Insufficient stock for: {products[bc]['name']}"}), 400
+
+            cur = conn.executemany(
+                "UPDATE products SET quantity = quantity - ? WHERE id = ? AND quantity >= ?",
+                [(qty, products[bc]['id'], qty) for bc, qty in wanted.items()]
+            )
+            if cur.rowcount != len(wanted):
+                conn.rollback()
+                return jsonify({"success": False, "message": "Stock changed during checkout, please try again"}), 409
+
+            # Receipt numbers come from a counter bumped under the write lock: unique and monotonic
+            receipt_number = f"R{_next_sequence(conn, 'receipt'):08d}"
+            change = payment_amount - total_amount if payment_method == 'CASH' else 0
+            sale_id = conn.execute("""
+                INSERT INTO sales (receipt_number, payment_method, total_amount, payment_amount, change_amount, items_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (receipt_number, payment_method, total_amount, payment_amount, change,
+                  sum(wanted.values()))).lastrowid
+
+            conn.executemany("""
+                INSERT INTO sale_lines (sale_id, product_id, barcode, product_name, quantity, unit_price, line_total, unit_cost)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(sale_id, products[bc]['id'], bc, products[bc]['name'], qty, products[bc]['retail_price'],
+                   products[bc]['retail_price'] * qty, products[bc]['cost_price']) for bc, qty in wanted.items()])
+
+            _insert_ledger(conn, [{
+                "product_id": products[bc]['id'],
+                "barcode": bc,
+                "transaction_type": "sale",
+                "quantity": qty,
+                "price": products[bc]['retail_price'],
+                "total_value": products[bc]['retail_price'] * qty,
+                "notes": f"POS Sale - Receipt: {receipt_number} - {payment_method}",
+                "unit_cost": products[bc]['cost_price']
+            } for bc, qty in wanted.items()])
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
-        conn.commit()
-        conn.close()
+        publish_stock_changes([(products[bc], products[bc]['quantity'] - qty) for bc, qty in wanted.items()])
+        EVENTS.publish("sale", {
+            "receipt_number": receipt_number,
+            "total_amount": total_amount,
+            "payment_method": payment_method,
+            "items": sum(wanted.values())
+        })
 
         return jsonify({
             "success": True,
             "message": "Sale completed successfully",
             "receipt_number": receipt_number,
+            "sale_id": sale_id,
             "total_amount": total_amount,
-            "change": payment_amount - total_amount if payment_method == 'CASH' else 0
+            "change": change
         })
 
     except Exception as e:
         print(f"Error completing POS sale: {e}")
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
+@app.route("/api/pos/receipts/<receipt_number>")
+def api_get_receipt(receipt_number):
+    """Receipt header + lines"""
+    try:
+        conn = get_db()
+        sale = conn.execute("SELECT * FROM sales WHERE receipt_number = ?", (receipt_number,)).fetchone()
+        if not sale:
+            return jsonify({"success": False, "message": "Receipt not found"}), 404
+
+        lines = conn.execute("""
+            SELECT product_id, barcode, product_name, quantity, unit_price, line_total
+            FROM sale_lines
+            WHERE sale_id = ?
+            ORDER BY id
+        """, (sale['id'],)).fetchall()
+
+        return jsonify({"success": True, "sale": dict(sale), "lines": [dict(line) for line in lines]})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+
+@app.route("/api/pos/receipts")
+def api_list_receipts():
+    """Receipts in a date range (optionally one payment method) with totals per payment method"""
+    try:
+        date_from = request.args.get('date_from') or datetime.now().strftime('%Y-%m-%d')
+        date_to = request.args.get('date_to') or date_from
+        payment_method = request.args.get('payment_method')
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+
+        # Local calendar days -> UTC bounds on sales.timestamp
+        start, end = utc_bounds(datetime.strptime(date_from, '%Y-%m-%d').date(),
+                                datetime.strptime(date_to, '%Y-%m-%d').date() + timedelta(days=1))
+
+        where = "timestamp >= ? AND timestamp < ?"
+        params = [start, end]
+        if payment_method:
+            where = "payment_method = ? AND " + where
+            params.insert(0, payment_method)
+
+        conn = get_db()
+        sales = conn.execute(f"""
+            SELECT * FROM sales
+            WHERE {where}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        """, params + [limit]).fetchall()
+
+        totals = conn.execute(f"""
+            SELECT payment_method, COUNT(*) AS receipts, SUM(total_amount) AS total_amount
+            FROM sales
+            WHERE {where}
+            GROUP BY payment_method
+            ORDER BY payment_method
+        """, params).fetchall()
+
+        return jsonify({
+            "success": True,
+            "sales": [dict(x) for x in sales],
+            "totals_by_method": [dict(x) for x in totals]
+        })
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
 # =========================================
 # ADVANCED ANALYTICS API
 # =========================================
 
+def _report_version(conn):
+    """(ledger_version, catalog_version, local date): changes whenever a cached report could"""
+    row = conn.execute("""
+        SELECT (SELECT value FROM sequences WHERE name = 'ledger_version') AS ledger,
+               (SELECT value FROM sequences WHERE name = 'catalog_version') AS catalog
+    """).fetchone()
+    return row["ledger"], row["catalog"], datetime.now().date().isoformat()
+
+
+def cached_report(view):
+    """Serve a JSON report route from ANALYTICS_CACHE, keyed by path + query string"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        version = _report_version(get_db())
+        body = ANALYTICS_CACHE.get(key, version)
+        if body is not None:
+            return Response(body, mimetype="application/json")
+
+        started = time.perf_counter()
+        response = view(*args, **kwargs)
+        if isinstance(response, Response) and response.status_code == 200:
+            ANALYTICS_CACHE.put(key, version, response.get_data(), (time.perf_counter() - started) * 1000)
+        return response
+    return wrapper
+
+
 @app.route("/api/analytics/sales-overview")
+@cached_report
 def api_sales_overview():
     """Sales statistics for dashboard"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
         current_year = datetime.now().year
         last_year = current_year - 1
+        this_year_range = period_dates("this_year")
+        last_year_range = period_dates("last_year")
 
         # This year's sales (with count)
         sales_this_year = conn.execute("""
             SELECT 
-                strftime('%m', timestamp) AS month,
-                SUM(total_value)         AS monthly_sales,
-                COUNT(*)                 AS transactions_count
-            FROM transactions
-            WHERE transaction_type = 'sale'
-              AND strftime('%Y', timestamp) = ?
-            GROUP BY strftime('%m', timestamp)
+                strftime('%m', sale_date) AS month,
+                SUM(revenue)              AS monthly_sales,
+                SUM(tx_count)             AS transactions_count
+            FROM daily_sales_rollup
+            WHERE sale_date >= ? AND sale_date < ?
+            GROUP BY month
             ORDER BY month
-        """, (str(current_year),)).fetchall()
+        """, this_year_range).fetchall()
 
         # Last year's sales (amounts only)
         sales_last_year = conn.execute("""
             SELECT 
-                strftime('%m', timestamp) AS month,
-                SUM(total_value)          AS monthly_sales
-            FROM transactions
-            WHERE transaction_type = 'sale'
-              AND strftime('%Y', timestamp) = ?
-            GROUP BY strftime('%m', timestamp)
+                strftime('%m', sale_date) AS month,
+                SUM(revenue)              AS monthly_sales
+            FROM daily_sales_rollup
+            WHERE sale_date >= ? AND sale_date < ?
+            GROUP BY month
             ORDER BY month
-        """, (str(last_year),)).fetchall()
+        """, last_year_range).fetchall()
 
         # Top products this year
         top_products = conn.execute("""
             SELECT 
                 p.name,
                 p.barcode,
-                SUM(t.quantity)                         AS total_sold,
-                SUM(t.total_value)                      AS total_revenue,
-                (p.retail_price - p.cost_price) * SUM(t.quantity) AS total_profit
-            FROM transactions t
-            JOIN products p ON t.product_id = p.id
-            WHERE t.transaction_type = 'sale'
-              AND strftime('%Y', t.timestamp) = ?
+                SUM(r.units)                    AS total_sold,
+                SUM(r.revenue)                  AS total_revenue,
+                SUM(r.revenue) - SUM(r.cost)    AS total_profit
+            FROM daily_sales_rollup r
+            JOIN products p ON r.product_id = p.id
+            WHERE r.sale_date >= ? AND r.sale_date < ?
             GROUP BY p.id
             ORDER BY total_sold DESC
             LIMIT 10
-        """, (str(current_year),)).fetchall()
+        """, this_year_range).fetchall()
 
         # Sales by category this year
         sales_by_category = conn.execute("""
             SELECT 
                 COALESCE(c.name, 'Uncategorized') AS category_name,
-                SUM(t.total_value)                AS total_sales,
-                COUNT(*)                          AS transactions_count
-            FROM transactions t
-            JOIN products p ON t.product_id = p.id
-            LEFT JOIN categories c ON p.category_id = c.id
-            WHERE t.transaction_type = 'sale'
-              AND strftime('%Y', t.timestamp) = ?
+                SUM(r.revenue)                    AS total_sales,
+                SUM(r.tx_count)                   AS transactions_count
+            FROM daily_sales_rollup r
+            LEFT JOIN categories c ON r.category_id = c.id
+            WHERE r.sale_date >= ? AND r.sale_date < ?
             GROUP BY c.id
             ORDER BY total_sales DESC
-        """, (str(current_year),)).fetchall()
+        """, this_year_range).fetchall()
 
         # Last 30 days daily sales
         daily_sales = conn.execute("""
             SELECT 
-                DATE(timestamp)      AS date,
-                SUM(total_value)     AS daily_sales,
-                COUNT(*)             AS daily_transactions
-            FROM transactions
-            WHERE transaction_type = 'sale'
-              AND timestamp >= date('now', '-30 days')
-            GROUP BY DATE(timestamp)
+                sale_date          AS date,
+                SUM(revenue)       AS daily_sales,
+                SUM(tx_count)      AS daily_transactions
+            FROM daily_sales_rollup
+            WHERE sale_date >= ? AND sale_date < ?
+            GROUP BY sale_date
             ORDER BY date
-        """).fetchall()
+        """, period_dates("last_30_days")).fetchall()
 
-        conn.close()
 
         # Datasets for charts
         months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
@@ -1078,20 +2911,108 @@ def api_sales_overview():
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
 
+TURNOVER_MAX_DAYS = 730
+TURNOVER_MAX_LIMIT = 100
+
+
+def product_turnover_report(conn, days=30, limit=15, order="fast", today=None):
+    """
+    Fast/slow movers over the last `days` local days (today included).
+    Only products that sold in the window are considered: sales come from the rollup's
+    date range, receipts from the indexed ledger range, and just those rows are joined to products.
+    - turnover_ratio: units sold / average stock, where opening stock is estimated as
+      closing + sold - received
+    - days_of_cover: days the current stock lasts at the window's average daily sales
+    order="fast" sorts by turnover_ratio, order="slow" by days_of_cover (most cover first).
+    """
+    today = today or datetime.now().date()
+    start, end = today - timedelta(days=days - 1), today + timedelta(days=1)
+    order_by = ("days_of_cover DESC, turnover_ratio" if order == "slow"
+                else "turnover_ratio IS NULL, turnover_ratio DESC")
+    return conn.execute(f"""
+        WITH sold AS (
+            SELECT product_id, SUM(units) AS units
+            FROM daily_sales_rollup
+            WHERE sale_date >= ? AND sale_date < ? AND product_id > 0
+            GROUP BY product_id
+            HAVING SUM(units) > 0
+        ),
+        received AS (
+            SELECT product_id, SUM(quantity) AS units
+            FROM transactions_all
+            WHERE transaction_type = 'receiving'
+              AND timestamp >= ? AND timestamp < ?
+              AND product_id IN (SELECT product_id FROM sold)
+            GROUP BY product_id
+        ),
+        movement AS (
+            SELECT
+                p.name,
+                p.barcode,
+                p.quantity,
+                sold.units AS units_sold,
+                COALESCE(received.units, 0) AS units_received,
+                (p.quantity + MAX(p.quantity + sold.units - COALESCE(received.units, 0), 0)) / 2.0 AS avg_stock
+            FROM sold
+            JOIN products p ON p.id = sold.product_id
+            LEFT JOIN received ON received.product_id = sold.product_id
+        )
+        SELECT
+            name,
+            barcode,
+            quantity,
+            units_sold,
+            units_received,
+            CASE WHEN avg_stock > 0 THEN units_sold / avg_stock END AS turnover_ratio,
+            ROUND(units_sold * 1.0 / ?, 3) AS daily_units,
+            ROUND(MAX(quantity, 0) * ? * 1.0 / units_sold, 1) AS days_of_cover
+        FROM movement
+        ORDER BY {order_by}
+        LIMIT ?
+    """, (start.isoformat(), end.isoformat()) + utc_bounds(start, end) + (days, days, limit)).fetchall()
+
+
+@app.route("/api/analytics/turnover")
+@cached_report
+def api_product_turnover():
+    """Fast/slow movers: ?days=30&limit=15&order=fast|slow"""
+    try:
+        days = request.args.get("days", 30, type=int)
+        limit = request.args.get("limit", 15, type=int)
+        order = request.args.get("order", "fast")
+        if not 1 <= days <= TURNOVER_MAX_DAYS:
+            return jsonify({"success": False, "message": f"days must be between 1 and {TURNOVER_MAX_DAYS}"}), 400
+        if not 1 <= limit <= TURNOVER_MAX_LIMIT:
+            return jsonify({"success": False, "message": f"limit must be between 1 and {TURNOVER_MAX_LIMIT}"}), 400
+        if order not in ("fast", "slow"):
+            return jsonify({"success": False, "message": "order must be 'fast' or 'slow'"}), 400
+
+        rows = product_turnover_report(get_db(), days=days, limit=limit, order=order)
+        return jsonify({
+            "days": days,
+            "order": order,
+            "products": [dict(row) for row in rows]
+        })
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+
 @app.route("/api/analytics/inventory-metrics")
+@cached_report
 def api_inventory_metrics():
     """Inventory metrics"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
         # Total inventory value
         inventory_value = conn.execute("""
             SELECT 
-                SUM(quantity * cost_price) as total_cost_value,
-                SUM(quantity * retail_price) as total_retail_value,
-                COUNT(*) as total_products,
-                SUM(quantity) as total_units
-            FROM products
+                total_cost as total_cost_value,
+                total_retail as total_retail_value,
+                total_products,
+                total_stock as total_units
+            FROM inventory_stats
+            WHERE id = 1
         """).fetchone()
 
         # Inventory distribution by category
@@ -1108,29 +3029,9 @@ def api_inventory_metrics():
             ORDER BY cost_value DESC
         """).fetchall()
 
-        # Fast/slow moving products (last 30 days)
-        product_turnover = conn.execute("""
-            SELECT 
-                p.name,
-                p.barcode,
-                p.quantity,
-                COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.quantity ELSE 0 END), 0) as units_sold,
-                COALESCE(SUM(CASE WHEN t.transaction_type = 'receiving' THEN t.quantity ELSE 0 END), 0) as units_received,
-                CASE 
-                    WHEN p.quantity > 0 THEN 
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.quantity ELSE 0 END), 0) / p.quantity 
-                    ELSE 0 
-                END as turnover_ratio
-            FROM products p
-            LEFT JOIN transactions t ON p.id = t.product_id 
-                AND t.timestamp >= date('now', '-30 days')
-            GROUP BY p.id
-            HAVING units_sold > 0
-            ORDER BY turnover_ratio DESC
-            LIMIT 15
-        """).fetchall()
+        # Fast moving products (last 30 days)
+        product_turnover = product_turnover_report(conn, days=30, limit=15)
 
-        conn.close()
 
         return jsonify({
             "inventory_value": dict(inventory_value),
@@ -1143,76 +3044,68 @@ def api_inventory_metrics():
 
 
 @app.route("/api/analytics/profit-analysis")
+@cached_report
 def api_profit_analysis():
     """Profit analysis"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
         # Monthly profits (last 12 months)
         monthly_profits = conn.execute("""
             SELECT 
-                strftime('%Y-%m', timestamp) as month,
-                SUM(total_value) as revenue,
-                SUM(quantity * (
-                    SELECT cost_price FROM products WHERE id = transactions.product_id
-                )) as cost,
-                SUM(total_value) - SUM(quantity * (
-                    SELECT cost_price FROM products WHERE id = transactions.product_id
-                )) as profit
-            FROM transactions 
-            WHERE transaction_type = 'sale'
-            AND timestamp >= date('now', '-12 months')
-            GROUP BY strftime('%Y-%m', timestamp)
+                strftime('%Y-%m', sale_date) as month,
+                SUM(revenue) as revenue,
+                SUM(cost) as cost,
+                SUM(revenue) - SUM(cost) as profit
+            FROM daily_sales_rollup
+            WHERE sale_date >= ? AND sale_date < ?
+            GROUP BY month
             ORDER BY month
-        """).fetchall()
+        """, period_dates("last_12_months")).fetchall()
 
         # Profit by category (last 6 months)
         profit_by_category = conn.execute("""
             SELECT 
                 c.name as category_name,
-                SUM(t.total_value) as revenue,
-                SUM(t.quantity * p.cost_price) as cost,
-                SUM(t.total_value) - SUM(t.quantity * p.cost_price) as profit,
+                SUM(r.revenue) as revenue,
+                SUM(r.cost) as cost,
+                SUM(r.revenue) - SUM(r.cost) as profit,
                 CASE 
-                    WHEN SUM(t.quantity * p.cost_price) > 0 
-                    THEN (SUM(t.total_value) - SUM(t.quantity * p.cost_price)) / SUM(t.quantity * p.cost_price) * 100
+                    WHEN SUM(r.cost) > 0 
+                    THEN (SUM(r.revenue) - SUM(r.cost)) / SUM(r.cost) * 100
                     ELSE 0
                 END as profit_margin
-            FROM transactions t
-            JOIN products p ON t.product_id = p.id
-            LEFT JOIN categories c ON p.category_id = c.id
-            WHERE t.transaction_type = 'sale'
-            AND t.timestamp >= date('now', '-6 months')
+            FROM daily_sales_rollup r
+            LEFT JOIN categories c ON r.category_id = c.id
+            WHERE r.sale_date >= ? AND r.sale_date < ?
             GROUP BY c.id
             HAVING revenue > 0
             ORDER BY profit DESC
-        """).fetchall()
+        """, period_dates("last_6_months")).fetchall()
 
         # Profit by product (last 6 months)
         top_profitable_products = conn.execute("""
             SELECT 
                 p.name,
                 p.barcode,
-                SUM(t.quantity) as units_sold,
-                SUM(t.total_value) as revenue,
-                SUM(t.quantity * p.cost_price) as cost,
-                SUM(t.total_value) - SUM(t.quantity * p.cost_price) as profit,
+                SUM(r.units) as units_sold,
+                SUM(r.revenue) as revenue,
+                SUM(r.cost) as cost,
+                SUM(r.revenue) - SUM(r.cost) as profit,
                 CASE 
-                    WHEN SUM(t.quantity * p.cost_price) > 0 
-                    THEN (SUM(t.total_value) - SUM(t.quantity * p.cost_price)) / SUM(t.quantity * p.cost_price) * 100
+                    WHEN SUM(r.cost) > 0 
+                    THEN (SUM(r.revenue) - SUM(r.cost)) / SUM(r.cost) * 100
                     ELSE 0
                 END as profit_margin
-            FROM transactions t
-            JOIN products p ON t.product_id = p.id
-            WHERE t.transaction_type = 'sale'
-            AND t.timestamp >= date('now', '-6 months')
+            FROM daily_sales_rollup r
+            JOIN products p ON r.product_id = p.id
+            WHERE r.sale_date >= ? AND r.sale_date < ?
             GROUP BY p.id
             HAVING profit > 0
             ORDER BY profit DESC
             LIMIT 15
-        """).fetchall()
+        """, period_dates("last_6_months")).fetchall()
 
-        conn.close()
 
         return jsonify({
             "monthly_profits": [dict(month) for month in monthly_profits],
@@ -1224,43 +3117,174 @@ def api_profit_analysis():
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
 # =========================================
-# PURCHASE ORDERS API
+# DEMAND FORECASTING
 # =========================================
+FORECAST_HISTORY_DAYS = 90     # days of daily sales fed to the model (yesterday and before)
+FORECAST_ALPHA = 0.2           # exponential smoothing factor
+FORECAST_MA_DAYS = 28          # window for method="ma"
+FORECAST_LEAD_DAYS = 7         # supplier lead time covered by the reorder point
+FORECAST_REVIEW_DAYS = 14      # days of demand one order should cover
+FORECAST_SERVICE_Z = 1.65      # safety stock z-score (~95% cycle service level)
+MAINTENANCE_INTERVAL = 24 * 3600
+
+FORECAST_UPSERT_SQL = """
+    INSERT INTO product_forecasts (product_id, daily_demand, demand_std, safety_stock,
+                                   reorder_point, reorder_qty, method, updated)
+    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(product_id) DO UPDATE SET
+        daily_demand = excluded.daily_demand,
+        demand_std = excluded.demand_std,
+        safety_stock = excluded.safety_stock,
+        reorder_point = excluded.reorder_point,
+        reorder_qty = excluded.reorder_qty,
+        method = excluded.method,
+        updated = excluded.updated
+"""
+
+
+def refresh_forecasts(method="ses", history_days=FORECAST_HISTORY_DAYS, lead_days=FORECAST_LEAD_DAYS,
+                      review_days=FORECAST_REVIEW_DAYS, service_z=FORECAST_SERVICE_Z, today=None):
+    """
+    Recompute product_forecasts for the whole catalog.
+    Daily units per product come from daily_sales_rollup into a products x days matrix;
+    demand (exponential smoothing "ses" or moving average "ma"), its deviation, safety stock,
+    reorder point and order quantity are computed column-wise over every product at once,
+    then written back in one transaction.
+    """
+    if np is None:
+        raise RuntimeError("Demand forecasting needs NumPy (pip install numpy)")
+    if method not in ("ses", "ma"):
+        raise ValueError("method must be 'ses' or 'ma'")
+    today = today or datetime.now().date()
+    start = today - timedelta(days=history_days)
+    started = time.perf_counter()
+
+    with POOL.connection() as conn:
+        cur = conn.cursor()
+        cur.row_factory = None   # plain tuples straight into NumPy
+        ids = np.array([row[0] for row in cur.execute("SELECT id FROM products ORDER BY id")], dtype=np.int64)
+        sales = np.array(cur.execute("""
+            SELECT product_id, CAST(julianday(sale_date) - julianday(?) AS INTEGER), units
+            FROM daily_sales_rollup
+            WHERE sale_date >= ? AND sale_date < ? AND product_id > 0
+        """, (start.isoformat(), start.isoformat(), today.isoformat())).fetchall(), dtype=np.float64).reshape(-1, 3)
+
+        history = np.zeros((len(ids), history_days))
+        if len(ids) and len(sales):
+            rows = np.searchsorted(ids, sales[:, 0].astype(np.int64))
+            known = rows < len(ids)
+            known[known] = ids[rows[known]] == sales[known, 0]   # skip sales of deleted products
+            # add.at: a product can have one rollup row per category it was sold under
+            np.add.at(history, (rows[known], sales[known, 1].astype(np.int64)), sales[known, 2])
+
+        if method == "ma":
+            demand = history[:, -FORECAST_MA_DAYS:].mean(axis=1)
+        else:
+            # Closed form of level = alpha * x + (1 - alpha) * level, seeded with the window mean
+            weights = FORECAST_ALPHA * (1 - FORECAST_ALPHA) ** np.arange(history_days - 1, -1, -1)
+            demand = history @ weights + (1 - FORECAST_ALPHA) ** history_days * history.mean(axis=1)
+        deviation = history.std(axis=1, ddof=1) if history_days > 1 else np.zeros(len(ids))
+        safety = service_z * deviation * np.sqrt(lead_days)
+        reorder_point = np.ceil(demand * lead_days + safety - 1e-9)
+        reorder_qty = np.ceil(demand * review_days - 1e-9)
+
+        records = zip(ids.tolist(), np.round(demand, 4).tolist(), np.round(deviation, 4).tolist(),
+                      np.round(safety, 2).tolist(), reorder_point.astype(np.int64).tolist(),
+                      reorder_qty.astype(np.int64).tolist(), [method] * len(ids))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(FORECAST_UPSERT_SQL, records)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
-@app.route("/api/export/purchase-orders/<int:order_id>", methods=["GET"])
-def api_export_purchase_order_single(order_id):
-    import csv
-    from io import StringIO
-    from flask import Response
+    elapsed = round((time.perf_counter() - started) * 1000, 2)
+    print(f"Forecasts refreshed: {len(ids)} products ({method}) in {elapsed} ms")
+    return {"products": len(ids), "method": method, "history_days": history_days, "ms": elapsed}
 
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
 
-    # Order header
-    cur.execute("""
-        SELECT po.*, s.name AS supplier_name
+def _background_maintenance():
+    """Refresh forecasts (and archive closed ledger months if ARCHIVE_AUTO) at startup, then once a day"""
+    jobs = (archive_ledger, refresh_forecasts) if ARCHIVE_AUTO else (refresh_forecasts,)
+    while True:
+        for job in jobs:
+            try:
+                job()
+            except Exception as e:
+                print(f"Maintenance error in {job.__name__}:", e)
+        time.sleep(MAINTENANCE_INTERVAL)
+
+
+@app.route("/api/forecasts/refresh", methods=["POST"])
+def api_refresh_forecasts():
+    """Recompute reorder points: {"method": "ses"|"ma", "history_days", "lead_days", "review_days"}"""
+    try:
+        if np is None:
+            return jsonify({"success": False, "message": "Forecasting needs NumPy installed"}), 503
+        data = request.get_json(silent=True) or {}
+        method = data.get("method", "ses")
+        history_days = int(data.get("history_days", FORECAST_HISTORY_DAYS))
+        lead_days = int(data.get("lead_days", FORECAST_LEAD_DAYS))
+        review_days = int(data.get("review_days", FORECAST_REVIEW_DAYS))
+        if method not in ("ses", "ma"):
+            return jsonify({"success": False, "message": "method must be 'ses' or 'ma'"}), 400
+        if not (7 <= history_days <= 730 and 1 <= lead_days <= 180 and 1 <= review_days <= 180):
+            return jsonify({"success": False, "message": "history_days must be 7-730, lead_days and review_days 1-180"}), 400
+
+        summary = refresh_forecasts(method, history_days, lead_days, review_days)
+        return jsonify({"success": True, **summary})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+
+@app.route("/api/forecasts")
+def api_get_forecasts():
+    """Forecast per product; ?below_reorder=1 keeps products at or under their suggested reorder point"""
+    try:
+        limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        where = "WHERE p.quantity <= f.reorder_point AND f.reorder_qty > 0" if request.args.get("below_reorder") == "1" else ""
+        rows = get_db().execute(f"""
+            SELECT p.id AS product_id, p.barcode, p.name, p.quantity, p.min_stock, p.supplier_id,
+                   f.daily_demand, f.demand_std, f.safety_stock, f.reorder_point, f.reorder_qty,
+                   f.method, f.updated
+            FROM product_forecasts f
+            JOIN products p ON p.id = f.product_id
+            {where}
+            ORDER BY f.daily_demand DESC, p.id
+            LIMIT ? OFFSET ?
+        """, (limit, offset)).fetchall()
+        return jsonify({"success": True, "forecasts": [dict(row) for row in rows]})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+# =========================================
+# PURCHASE ORDERS API
+# =========================================
+
+def _purchase_order_file_csv(conn, order_id):
+    """
+    (order header row, CSV bytes with BOM) for one purchase order, or (None, None).
+    Header and lines come from one joined query.
+    """
+    lines = conn.execute("""
+        SELECT po.*, s.name AS supplier_name,
+               poi.id AS item_id, poi.product_id, poi.barcode, poi.product_name,
+               poi.quantity_ordered, poi.quantity_received, poi.unit_cost, poi.total_cost,
+               p.name AS actual_product_name, p.supplier_code
         FROM purchase_orders po
         LEFT JOIN suppliers s ON s.id = po.supplier_id
-        WHERE po.id = ?
-    """, (order_id,))
-    order = cur.fetchone()
-    if not order:
-        conn.close()
-        return jsonify({"success": False, "message": "Purchase order not found"}), 404
-
-    # Order lines
-    cur.execute("""
-        SELECT poi.*, p.name AS actual_product_name, p.supplier_code
-        FROM purchase_order_items poi
+        LEFT JOIN purchase_order_items poi ON poi.order_id = po.id
         LEFT JOIN products p ON p.id = poi.product_id
-        WHERE poi.order_id = ?
+        WHERE po.id = ?
         ORDER BY poi.id
-    """, (order_id,))
-    items = cur.fetchall()
-    conn.close()
+    """, (order_id,)).fetchall()
+    if not lines:
+        return None, None
+    order = lines[0]
+    items = [line for line in lines if line["item_id"] is not None]
 
-    # Create CSV (with BOM for proper Excel support)
     out = StringIO(newline="")
     w = csv.writer(out)
     w.writerow(["Purchase Order"])
@@ -1296,8 +3320,15 @@ def api_export_purchase_order_single(order_id):
     w.writerow([])
     w.writerow(["Computed Total", f"{total:.2f}"])
 
-    csv_text = out.getvalue()
-    csv_bytes = csv_text.encode("utf-8-sig")  # BOM for Excel on Windows
+    return order, out.getvalue().encode("utf-8-sig")  # BOM for Excel on Windows
+
+
+@app.route("/api/export/purchase-orders/<int:order_id>", methods=["GET"])
+def api_export_purchase_order_single(order_id):
+    order, csv_bytes = _purchase_order_file_csv(get_db(), order_id)
+    if not order:
+        return jsonify({"success": False, "message": "Purchase order not found"}), 404
+
     filename = f'purchase_order_{order["id"]}.csv'
 
     return Response(
@@ -1315,14 +3346,13 @@ def api_export_purchase_order_single(order_id):
 def api_get_purchase_orders():
     """Get all purchase orders"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
         orders = conn.execute("""
             SELECT po.*, s.name as supplier_name
             FROM purchase_orders po
             LEFT JOIN suppliers s ON po.supplier_id = s.id
             ORDER BY po.order_date DESC
         """).fetchall()
-        conn.close()
         return jsonify([dict(order) for order in orders])
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
@@ -1339,7 +3369,7 @@ def api_create_purchase_order():
         if not supplier_id or not items:
             return jsonify({"success": False, "message": "Supplier and products are required"}), 400
 
-        conn = get_db_connection()
+        conn = get_db()
 
         # Create unique order number
         order_number = f"PO{int(datetime.now().timestamp())}"
@@ -1372,7 +3402,6 @@ def api_create_purchase_order():
             ))
 
         conn.commit()
-        conn.close()
 
         return jsonify({
             "success": True,
@@ -1385,22 +3414,157 @@ def api_create_purchase_order():
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
 
-@app.route("/api/purchase-orders/<int:order_id>", methods=["GET"])
-def api_get_purchase_order(order_id):
-    """Get specific purchase order"""
-    try:
-        conn = get_db_connection()
-
-        # Order header
-        order = conn.execute("""
-            SELECT po.*, s.name as supplier_name, s.phone, s.email
-            FROM purchase_orders po
-            LEFT JOIN suppliers s ON po.supplier_id = s.id
-            WHERE po.id = ?
-        """, (order_id,)).fetchone()
+# Orders whose outstanding quantity counts as stock on the way ('σε εξέλιξη' = legacy "ordered")
+OPEN_PO_STATUSES = ("pending", "ordered", "partial", "σε εξέλιξη")
+REORDER_VELOCITY_DAYS = 30                   # sales window for the order quantity
+REORDER_COVER_DAYS = FORECAST_LEAD_DAYS + FORECAST_REVIEW_DAYS
+
+# One line per product at or below its reorder point, counting stock already on open orders.
+# Reorder point = the larger of the forecast's and the hand-set min_stock; quantity lifts the
+# position above the reorder point by velocity x cover days (at least 1 unit), so a second run
+# finds nothing left to order.
+REORDER_LINES_SQL = f"""
+    WITH on_order AS (
+        SELECT poi.product_id, SUM(MAX(poi.quantity_ordered - COALESCE(poi.quantity_received, 0), 0)) AS units
+        FROM purchase_orders po
+        JOIN purchase_order_items poi ON poi.order_id = po.id
+        WHERE po.status IN ({",".join("?" * len(OPEN_PO_STATUSES))}) AND poi.product_id IS NOT NULL
+        GROUP BY poi.product_id
+    ),
+    sold AS (
+        SELECT product_id, SUM(units) AS units
+        FROM daily_sales_rollup
+        WHERE sale_date >= ? AND sale_date < ? AND product_id > 0
+        GROUP BY product_id
+    ),
+    candidates AS (
+        SELECT p.id AS product_id, p.supplier_id, p.barcode, p.name AS product_name,
+               COALESCE(p.cost_price, 0) AS unit_cost,
+               MAX(COALESCE(f.reorder_point, 0), COALESCE(p.min_stock, 0)) AS reorder_point,
+               COALESCE(p.quantity, 0) + COALESCE(o.units, 0) AS position,
+               COALESCE(s.units, 0) * ? / ? AS cover_units
+        FROM products p
+        LEFT JOIN product_forecasts f ON f.product_id = p.id
+        LEFT JOIN on_order o ON o.product_id = p.id
+        LEFT JOIN sold s ON s.product_id = p.id
+        WHERE p.supplier_id IS NOT NULL {{supplier_filter}}
+    )
+    SELECT product_id, supplier_id, barcode, product_name, unit_cost,
+           reorder_point - position + 1
+               + CAST(cover_units AS INTEGER) + (cover_units > CAST(cover_units AS INTEGER)) AS quantity_ordered
+    FROM candidates
+    WHERE position <= reorder_point
+"""
+
+
+@app.route("/api/purchase-orders/generate", methods=["POST"])
+def api_generate_purchase_orders():
+    """
+    Draft ('pending') purchase orders, one per supplier, for every product at or below its
+    reorder point: {"supplier_id"?, "velocity_days"?, "cover_days"?, "dry_run"?}
+    Products already covered by open orders are skipped, so running it twice does not double up.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        supplier_id = data.get("supplier_id")
+        velocity_days = int(data.get("velocity_days", REORDER_VELOCITY_DAYS))
+        cover_days = int(data.get("cover_days", REORDER_COVER_DAYS))
+        dry_run = bool(data.get("dry_run"))
+        if not (1 <= velocity_days <= 365 and 1 <= cover_days <= 365):
+            return jsonify({"success": False, "message": "velocity_days and cover_days must be 1-365"}), 400
+
+        today = datetime.now().date()
+        params = [*OPEN_PO_STATUSES, (today - timedelta(days=velocity_days)).isoformat(), today.isoformat(),
+                  float(cover_days), float(velocity_days)]
+        supplier_filter = ""
+        if supplier_id is not None:
+            supplier_filter = "AND p.supplier_id = ?"
+            params.append(int(supplier_id))
+
+        started = time.perf_counter()
+        conn = get_db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # PO<timestamp>-<supplier>, moved past any second already used by a previous run
+            stamp = int(datetime.now().timestamp())
+            while conn.execute("""
+                SELECT 1 FROM purchase_orders WHERE order_number >= ? AND order_number < ? LIMIT 1
+            """, (f"PO{stamp}-", f"PO{stamp}.")).fetchone():
+                stamp += 1
+            conn.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS po_draft_lines (
+                    product_id INTEGER PRIMARY KEY, supplier_id INTEGER, barcode TEXT, product_name TEXT,
+                    unit_cost REAL, quantity_ordered INTEGER
+                )
+            """)
+            conn.execute("DELETE FROM po_draft_lines")
+            conn.execute("INSERT INTO po_draft_lines " + REORDER_LINES_SQL.format(supplier_filter=supplier_filter),
+                         params)
+
+            # One header per supplier
+            conn.execute("""
+                INSERT INTO purchase_orders (supplier_id, order_number, status, total_amount, notes)
+                SELECT supplier_id, 'PO' || ? || '-' || supplier_id, 'pending',
+                       SUM(quantity_ordered * unit_cost), 'Auto-generated from reorder points'
+                FROM po_draft_lines
+                GROUP BY supplier_id
+            """, (stamp,))
+            conn.execute("""
+                INSERT INTO purchase_order_items
+                    (order_id, product_id, barcode, product_name, quantity_ordered, unit_cost, total_cost)
+                SELECT po.id, l.product_id, l.barcode, l.product_name, l.quantity_ordered, l.unit_cost,
+                       l.quantity_ordered * l.unit_cost
+                FROM po_draft_lines l
+                JOIN purchase_orders po ON po.order_number = 'PO' || ? || '-' || l.supplier_id
+                ORDER BY po.id, l.product_name
+            """, (stamp,))
+            orders = conn.execute("""
+                SELECT po.id AS order_id, po.order_number, po.supplier_id, s.name AS supplier_name,
+                       COUNT(*) AS items, SUM(l.quantity_ordered) AS units, po.total_amount
+                FROM po_draft_lines l
+                JOIN purchase_orders po ON po.order_number = 'PO' || ? || '-' || l.supplier_id
+                LEFT JOIN suppliers s ON s.id = po.supplier_id
+                GROUP BY po.id
+                ORDER BY s.name
+            """, (stamp,)).fetchall()
+
+            conn.execute("DELETE FROM po_draft_lines")
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        return jsonify({
+            "success": True,
+            "dry_run": dry_run,
+            "orders": [dict(order) for order in orders],
+            "ms": round((time.perf_counter() - started) * 1000, 2)
+        })
+
+    except (ValueError, TypeError) as e:
+        return jsonify({"success": False, "message": f"Invalid value: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+
+@app.route("/api/purchase-orders/<int:order_id>", methods=["GET"])
+def api_get_purchase_order(order_id):
+    """Get specific purchase order"""
+    try:
+        conn = get_db()
+
+        # Order header
+        order = conn.execute("""
+            SELECT po.*, s.name as supplier_name, s.phone, s.email
+            FROM purchase_orders po
+            LEFT JOIN suppliers s ON po.supplier_id = s.id
+            WHERE po.id = ?
+        """, (order_id,)).fetchone()
 
         if not order:
-            conn.close()
             return jsonify({"success": False, "message": "Purchase order not found"}), 404
 
         # Order items
@@ -1412,7 +3576,6 @@ def api_get_purchase_order(order_id):
             WHERE poi.order_id = ?
         """, (order_id,)).fetchall()
 
-        conn.close()
 
         return jsonify({
             "order": dict(order),
@@ -1430,7 +3593,11 @@ from flask import request, jsonify
 
 @app.route("/api/purchase-orders/<int:order_id>/status", methods=["PUT"])
 def api_update_order_status(order_id):
-    """Update status + receiving with invoice & optional cost_price update per product"""
+    """
+    Update status + receiving with invoice & optional cost_price update per product.
+    Receiving books what is still outstanding on each line, or just this delivery's
+    quantities when items carry "quantity"; the order becomes 'partial' until every line is in.
+    """
     from datetime import date
     data = request.get_json(silent=True) or {}
 
@@ -1438,84 +3605,186 @@ def api_update_order_status(order_id):
     invoice_number = data.get("invoice_number") or None
     invoice_date = data.get("invoice_date") or None
     update_buy = bool(data.get("update_buy_price"))
-
-    # items: [{product_id: 26, new_cost: 1.25}, ...] for cost update per product
-    overrides_list = data.get("items") or []
-    override_prices = {}
-    for it in overrides_list:
+    receipt_key = (str(data.get("receipt_key") or "").strip() or None)
+
+    # items: [{item_id: 7, new_cost: 1.25, quantity: 4}, ...] cost override and/or delivered quantity per
+    # order line (purchase_order_items.id); the older {product_id, new_cost} form still sets the cost of
+    # that product's lines, but a delivered quantity needs the line's item_id
+    requested = {}
+    by_product = {}
+    for it in data.get("items") or []:
         try:
-            pid = int(it.get("product_id"))
-            nc = float(it.get("new_cost"))
-            override_prices[pid] = nc
+            item_id = int(it["item_id"]) if it.get("item_id") is not None else None
+            pid = int(it["product_id"]) if item_id is None else None
         except Exception:
-            pass
-
-    valid_statuses = ['pending', 'ordered', 'received', 'cancelled', 'ολοκληρωμένη', 'σε εξέλιξη']
+            continue
+        try:
+            new_cost = float(it["new_cost"]) if it.get("new_cost") is not None else None
+        except Exception:
+            new_cost = None
+        try:
+            quantity = max(int(it["quantity"]), 0) if it.get("quantity") is not None else None
+        except Exception:
+            quantity = None
+        if item_id is not None:
+            requested[item_id] = (item_id, quantity, new_cost)
+        else:
+            by_product[pid] = (None, new_cost)
+    partial_delivery = any(quantity is not None for _, quantity, _ in requested.values())
+
+    valid_statuses = ['pending', 'ordered', 'partial', 'received', 'cancelled', 'ολοκληρωμένη', 'σε εξέλιξη']
     if new_status not in valid_statuses:
         return jsonify({"success": False, "message": "Invalid status"}), 400
 
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
     po = cur.execute("SELECT id, status FROM purchase_orders WHERE id=?", (order_id,)).fetchone()
     if not po:
-        conn.close()
         return jsonify({"success": False, "message": "Purchase order not found"}), 404
 
     # Receiving
-    if new_status in ("received", "ολοκληρωμένη"):
-        # Get order items
-        items = cur.execute("""
-            SELECT product_id, barcode, quantity_ordered, unit_cost
-            FROM purchase_order_items
-            WHERE order_id = ?
-        """, (order_id,)).fetchall()
+    if new_status in ("received", "partial", "ολοκληρωμένη"):
+        conn.execute("BEGIN IMMEDIATE")   # outstanding quantities cannot change under us
+        try:
+            if receipt_key and cur.execute("SELECT 1 FROM po_receipts WHERE receipt_key = ?", (receipt_key,)).fetchone():
+                conn.rollback()
+                status = conn.execute("SELECT status FROM purchase_orders WHERE id=?", (order_id,)).fetchone()[0]
+                return jsonify({"success": True, "duplicate": True, "status": status, "received_units": 0})
 
-        for it in items:
-            pid = it["product_id"]
-            bc = it["barcode"]
-            qty = it["quantity_ordered"]
-            cost = override_prices.get(pid, it["unit_cost"])  # use new cost if provided
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS po_receive_items (
+                    item_id INTEGER PRIMARY KEY, quantity INTEGER, new_cost REAL
+                )
+            """)
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS po_receive_lines (
+                    item_id INTEGER PRIMARY KEY, product_id INTEGER, barcode TEXT, quantity INTEGER, unit_cost REAL,
+                    cost_changed INTEGER
+                )
+            """)
+            cur.execute("DELETE FROM po_receive_items")
+            cur.execute("DELETE FROM po_receive_lines")
+            if by_product:
+                for row in cur.execute("""
+                    SELECT id, product_id FROM purchase_order_items WHERE order_id = ? AND product_id IS NOT NULL
+                """, (order_id,)).fetchall():
+                    if row["id"] not in requested and row["product_id"] in by_product:
+                        requested[row["id"]] = (row["id"], *by_product[row["product_id"]])
+            cur.executemany("INSERT INTO po_receive_items (item_id, quantity, new_cost) VALUES (?, ?, ?)",
+                            list(requested.values()))
+
+            # This delivery per line, never more than is still outstanding
+            cur.execute("""
+                INSERT INTO po_receive_lines (item_id, product_id, barcode, quantity, unit_cost, cost_changed)
+                SELECT poi.id, poi.product_id, poi.barcode,
+                       MIN(MAX(poi.quantity_ordered - COALESCE(poi.quantity_received, 0), 0),
+                           COALESCE(r.quantity, CASE WHEN ? THEN 0 ELSE poi.quantity_ordered END)),
+                       COALESCE(r.new_cost, poi.unit_cost, 0),
+                       r.new_cost IS NOT NULL
+                FROM purchase_order_items poi
+                LEFT JOIN po_receive_items r ON r.item_id = poi.id
+                WHERE poi.order_id = ? AND poi.product_id IS NOT NULL
+            """, (partial_delivery, order_id))
 
-            if pid is None:
-                continue
+            # If cost changed in modal, update order item lines
+            cur.execute("""
+                UPDATE purchase_order_items
+                SET unit_cost = (SELECT unit_cost FROM po_receive_lines WHERE item_id = purchase_order_items.id),
+                    total_cost = quantity_ordered * (SELECT unit_cost FROM po_receive_lines WHERE item_id = purchase_order_items.id)
+                WHERE id IN (SELECT item_id FROM po_receive_lines WHERE cost_changed)
+            """)
+            cur.execute("""
+                UPDATE purchase_order_items
+                SET quantity_received = COALESCE(quantity_received, 0)
+                    + (SELECT quantity FROM po_receive_lines WHERE item_id = purchase_order_items.id)
+                WHERE id IN (SELECT item_id FROM po_receive_lines WHERE quantity > 0)
+            """)
 
-            # If cost changed in modal, update order item line
-            if pid in override_prices:
+            # Increase stock (and cost_price if requested), one statement for all products
+            cur.execute("""
+                UPDATE products
+                SET quantity = IFNULL(quantity, 0)
+                    + (SELECT SUM(quantity) FROM po_receive_lines WHERE product_id = products.id)
+                WHERE id IN (SELECT product_id FROM po_receive_lines WHERE quantity > 0)
+            """)
+            if update_buy:
                 cur.execute("""
-                    UPDATE purchase_order_items
-                    SET unit_cost = ?, total_cost = ?
-                    WHERE order_id = ? AND product_id = ?
-                """, (cost, cost * qty, order_id, pid))
+                    UPDATE products
+                    SET cost_price = (SELECT unit_cost FROM po_receive_lines
+                                      WHERE product_id = products.id AND quantity > 0
+                                      ORDER BY item_id DESC LIMIT 1)
+                    WHERE id IN (SELECT product_id FROM po_receive_lines WHERE quantity > 0)
+                """)
+
+            received = cur.execute("""
+                SELECT item_id, product_id, barcode, quantity, unit_cost
+                FROM po_receive_lines WHERE quantity > 0 ORDER BY item_id
+            """).fetchall()
+            received_units = sum(row["quantity"] for row in received)
+
+            # Log transactions + the receipt itself
+            _insert_ledger(conn, [
+                {"product_id": row["product_id"], "barcode": row["barcode"], "transaction_type": "receiving",
+                 "quantity": row["quantity"], "price": row["unit_cost"],
+                 "total_value": row["quantity"] * row["unit_cost"],
+                 "notes": f"Purchase order receiving #{order_id}"}
+                for row in received
+            ])
+            if received:
+                receipt_id = cur.execute("""
+                    INSERT INTO po_receipts (order_id, receipt_key, invoice_number, invoice_date, units)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (order_id, receipt_key, invoice_number, invoice_date, received_units)).lastrowid
+                cur.execute("""
+                    INSERT INTO po_receipt_lines (receipt_id, item_id, product_id, quantity, unit_cost)
+                    SELECT ?, item_id, product_id, quantity, unit_cost FROM po_receive_lines WHERE quantity > 0
+                """, (receipt_id,))
 
-            # Increase stock
-            cur.execute("UPDATE products SET quantity = IFNULL(quantity,0) + ? WHERE id = ?", (qty, pid))
+            outstanding = cur.execute("""
+                SELECT COALESCE(SUM(MAX(quantity_ordered - COALESCE(quantity_received, 0), 0)), 0)
+                FROM purchase_order_items WHERE order_id = ? AND product_id IS NOT NULL
+            """, (order_id,)).fetchone()[0]
+            status = "received" if outstanding == 0 else "partial"
 
-            # Update product cost_price if requested
-            if update_buy:
-                cur.execute("UPDATE products SET cost_price = ? WHERE id = ?", (cost, pid))
-
-            # Log transaction
+            # Lock order + invoice + receiving date
             cur.execute("""
-                INSERT INTO transactions (product_id, barcode, transaction_type, quantity, price, total_value, notes)
-                VALUES (?, ?, 'receiving', ?, ?, ?, ?)
-            """, (pid, bc, qty, cost, qty * cost, f"Purchase order receiving #{order_id}"))
-
-        # Lock order + invoice + receiving date
-        cur.execute("""
-            UPDATE purchase_orders
-            SET status='received',
-                invoice_number=?,
-                invoice_date=?,
-                date_received=?,
-                expected_date=?
-            WHERE id=?
-        """, (invoice_number, invoice_date, date.today().isoformat(), data.get('expected_date'), order_id))
-
-        conn.commit()
-        conn.close()
-        return jsonify({"success": True})
+                UPDATE purchase_orders
+                SET status=?,
+                    invoice_number=COALESCE(?, invoice_number),
+                    invoice_date=COALESCE(?, invoice_date),
+                    date_received=?,
+                    expected_date=?
+                WHERE id=?
+            """, (status, invoice_number, invoice_date, date.today().isoformat(), data.get('expected_date'), order_id))
+
+            cur.execute("DELETE FROM po_receive_items")
+            cur.execute("DELETE FROM po_receive_lines")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+        if update_buy and received:
+            CATALOG.clear()   # cost_price changed
+
+        received_ids = sorted({row["product_id"] for row in received})
+        for chunk in _chunks(received_ids):
+            for row in conn.execute(f"""
+                SELECT id, barcode, name, quantity, min_stock FROM products
+                WHERE id IN ({",".join("?" * len(chunk))})
+            """, chunk):
+                EVENTS.publish("stock", {
+                    "product_id": row["id"],
+                    "barcode": row["barcode"],
+                    "name": row["name"],
+                    "quantity": row["quantity"],
+                    "min_stock": row["min_stock"]
+                })
+        if received:
+            EVENTS.publish("po_received", {"order_id": order_id, "status": status})
+        return jsonify({"success": True, "status": status, "received_units": received_units,
+                        "outstanding_units": outstanding})
 
     # Other status changes (without receiving)
     cur.execute("""
@@ -1525,7 +3794,6 @@ def api_update_order_status(order_id):
     """, (new_status, data.get('expected_date'), order_id))
 
     conn.commit()
-    conn.close()
     return jsonify({"success": True, "message": "Status updated"})
 
 # =========================================
@@ -1536,7 +3804,7 @@ def api_update_order_status(order_id):
 def api_get_products_by_supplier(supplier_id):
     """Get products by supplier"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
         products = conn.execute("""
             SELECT p.*, c.name as category_name, s.name as supplier_name 
             FROM products p 
@@ -1545,7 +3813,6 @@ def api_get_products_by_supplier(supplier_id):
             WHERE p.supplier_id = ?
             ORDER BY p.name
         """, (supplier_id,)).fetchall()
-        conn.close()
         return jsonify([dict(product) for product in products])
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
@@ -1566,7 +3833,7 @@ def api_add_supplier():
         if not name:
             return jsonify({"success": False, "message": "Supplier name is required"}), 400
 
-        conn = get_db_connection()
+        conn = get_db()
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO suppliers (name, phone, email) VALUES (?, ?, ?)",
@@ -1574,7 +3841,6 @@ def api_add_supplier():
         )
         conn.commit()
         new_id = cur.lastrowid
-        conn.close()
 
         return jsonify({"success": True, "supplier": {"id": new_id, "name": name, "phone": phone, "email": email}}), 201
 
@@ -1589,9 +3855,8 @@ def api_add_supplier():
 def api_get_suppliers():
     """Return all suppliers"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
         suppliers = conn.execute("SELECT id, name FROM suppliers ORDER BY name").fetchall()
-        conn.close()
         return jsonify([dict(s) for s in suppliers])
     except Exception as e:
         print("Error in api_get_suppliers:", e)
@@ -1605,17 +3870,21 @@ def api_get_suppliers():
 def api_search_product_by_barcode(barcode):
     """Search product by barcode"""
     try:
-        conn = get_db_connection()
-        product = conn.execute("""
-            SELECT p.*, c.name as category_name, s.name as supplier_name 
-            FROM products p 
-            LEFT JOIN categories c ON p.category_id = c.id 
-            LEFT JOIN suppliers s ON p.supplier_id = s.id 
-            WHERE p.barcode LIKE ? OR p.barcode = ?
-            ORDER BY p.name
+        conn = get_db()
+        # Exact and prefix matches use the barcode index; only a miss on both scans for a substring
+        product = conn.execute(f"""
+            {PRODUCT_SEARCH_SELECT}
+            WHERE p.barcode >= ? AND p.barcode < ?
+            ORDER BY p.barcode != ?, p.name
             LIMIT 1
-        """, (f"%{barcode}%", barcode)).fetchone()
-        conn.close()
+        """, (barcode, barcode + "\uffff", barcode)).fetchone()
+        if product is None:
+            product = conn.execute(f"""
+                {PRODUCT_SEARCH_SELECT}
+                WHERE p.barcode LIKE ?
+                ORDER BY p.name
+                LIMIT 1
+            """, (f"%{barcode}%",)).fetchone()
 
         if not product:
             return jsonify({"success": False, "message": "Product not found"}), 404
@@ -1624,6 +3893,441 @@ def api_search_product_by_barcode(barcode):
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
+# =========================================
+# BULK PRODUCT IMPORT
+# =========================================
+IMPORT_BATCH_ROWS = 1000    # rows validated and written per transaction
+IMPORT_MAX_ERRORS = 500     # per-row errors returned in the response
+
+# Accepted columns (CSV headers are matched case-insensitively, spaces = underscores,
+# so the products export can be imported back as is)
+IMPORT_TEXT_FIELDS = ("name", "description", "supplier_code")
+IMPORT_INT_FIELDS = ("quantity", "min_stock")
+IMPORT_PRICE_FIELDS = ("cost_price", "retail_price")
+IMPORT_DEFAULTS = {"description": "", "supplier_code": "", "quantity": 0, "min_stock": 1,
+                   "cost_price": 0.0, "retail_price": 0.0, "category_id": None, "supplier_id": None}
+
+
+def _import_records(fmt, delimiter):
+    """
+    Yield (line number, record) from the uploaded file (multipart 'file') or the raw body, read as a stream.
+    CSV records are dicts; JSON lines are yielded as text and parsed per row so a bad line is a row error.
+    """
+    upload = request.files.get("file")
+    stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(stream, delimiter=delimiter)
+        for record in reader:
+            yield reader.line_num, {(k or "").strip().lower().replace(" ", "_"): v for k, v in record.items()}
+    else:
+        for line_num, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_num, line
+
+
+def _parse_price(value):
+    text = str(value).replace("€", "").strip()
+    if "," in text and "." not in text:
+        text = text.replace(",", ".")
+    return float(text)
+
+
+class _ImportLookups:
+    """Category / supplier name -> id, loaded once per import; unknown names are created on demand"""
+
+    def __init__(self, conn, create_missing):
+        self.conn = conn
+        self.create_missing = create_missing
+        self.ids = {}
+        self.names = {}
+        for table in ("categories", "suppliers"):
+            rows = conn.execute(f"SELECT id, name FROM {table}").fetchall()
+            self.ids[table] = {row["id"] for row in rows}
+            self.names[table] = {row["name"].strip().lower(): row["id"] for row in rows}
+
+    @staticmethod
+    def label(table):
+        return "category" if table == "categories" else "supplier"
+
+    def resolve(self, table, id_value, name):
+        """Id for an explicit id (checked) or else a name"""
+        if id_value is not None:
+            ref = int(id_value)
+            if ref not in self.ids[table]:
+                raise ValueError(f"unknown {self.label(table)} id {ref}")
+            return ref
+        ref = self.names[table].get(name.lower())
+        if ref is None:
+            if not self.create_missing:
+                raise ValueError(f"unknown {self.label(table)} '{name}'")
+            ref = self.conn.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,)).lastrowid
+            self.ids[table].add(ref)
+            self.names[table][name.lower()] = ref
+        return ref
+
+
+def _validate_import_record(record, lookups):
+    """
+    Column dict (or JSON text) -> {products column: value}.
+    Only non-empty fields are returned: an empty cell leaves the stored value (or the default) alone.
+    """
+    if isinstance(record, str):
+        record = json.loads(record)
+        if not isinstance(record, dict):
+            raise ValueError("expected a JSON object")
+    record = {k: str(v).strip() for k, v in record.items() if v is not None and str(v).strip() != ""}
+    barcode = record.get("barcode")
+    if not barcode:
+        raise ValueError("barcode is required")
+    values = {"barcode": barcode}
+    for field in IMPORT_TEXT_FIELDS:
+        if field in record:
+            values[field] = record[field]
+    for field in IMPORT_INT_FIELDS:
+        if field in record:
+            values[field] = int(record[field])
+    for field in IMPORT_PRICE_FIELDS:
+        if field in record:
+            values[field] = _parse_price(record[field])
+            if values[field] < 0:
+                raise ValueError(f"{field} cannot be negative")
+    if "category_id" in record or "category" in record:
+        values["category_id"] = lookups.resolve("categories", record.get("category_id"), record.get("category"))
+    if "supplier_id" in record or "supplier" in record:
+        values["supplier_id"] = lookups.resolve("suppliers", record.get("supplier_id"), record.get("supplier"))
+    return values
+
+
+@functools.lru_cache(maxsize=64)
+def _import_write_sql(fields, new):
+    """INSERT for a new barcode; for an existing one an UPDATE of just the supplied columns (None if none)"""
+    if new:
+        return f"INSERT INTO products ({', '.join(fields)}) VALUES ({', '.join(f':{f}' for f in fields)})"
+    assignments = ", ".join(f"{f} = :{f}" for f in fields if f != "barcode")
+    return f"UPDATE products SET {assignments} WHERE barcode = :barcode" if assignments else None
+
+
+def _write_import_batch(conn, batch, update, summary):
+    """
+    One transaction: insert new barcodes with defaults, update existing ones with the given columns.
+    Rows are written in file order (consecutive rows with the same columns share one executemany),
+    so when a barcode repeats the last row wins.
+    """
+    existing = _fetch_products_by_barcodes(conn, {values["barcode"] for _, values in batch})
+    statements = []
+    for line, values in batch:
+        if values["barcode"] in existing:
+            if not update:
+                summary["skipped"] += 1
+                continue
+            summary["updated"] += 1
+            sql = _import_write_sql(tuple(values), False)
+            if sql is None:
+                continue
+        else:
+            if "name" not in values:
+                _import_error(summary, line, values["barcode"], "name is required for new products")
+                continue
+            summary["inserted"] += 1
+            existing[values["barcode"]] = values   # a repeat later in the file updates this row
+            values = {**IMPORT_DEFAULTS, **values}
+            sql = _import_write_sql(tuple(values), True)
+        statements.append((sql, values))
+    for sql, rows in groupby(statements, key=lambda statement: statement[0]):
+        conn.executemany(sql, [values for _, values in rows])
+
+
+def _import_error(summary, line, barcode, message):
+    summary["failed"] += 1
+    if len(summary["errors"]) < IMPORT_MAX_ERRORS:
+        summary["errors"].append({"row": line, "barcode": barcode, "error": message})
+
+
+@app.route("/api/products/import", methods=["POST"])
+def api_import_products():
+    """
+    Bulk product import. Body (or multipart field 'file') is CSV (?format=csv, default) or
+    JSON lines (?format=ndjson), one product per row: barcode, name, description, quantity,
+    min_stock, cost_price, retail_price, supplier_code, category / category_id, supplier / supplier_id.
+    ?mode=upsert (default) updates existing barcodes with the supplied columns, mode=insert skips them.
+    ?create_missing=0 rejects unknown category/supplier names instead of creating them.
+    """
+    try:
+        fmt = request.args.get("format", "csv").lower()
+        if fmt not in ("csv", "ndjson", "jsonl"):
+            return jsonify({"success": False, "message": "format must be csv or ndjson"}), 400
+        update = request.args.get("mode", "upsert") != "insert"
+        create_missing = request.args.get("create_missing", "1") not in ("0", "false")
+        delimiter = request.args.get("delimiter", ",")[:1] or ","
+
+        started = time.perf_counter()
+        summary = {"processed": 0, "inserted": 0, "updated": 0, "skipped": 0, "failed": 0, "errors": []}
+        conn = get_db()
+        lookups = _ImportLookups(conn, create_missing)
+        records = _import_records("csv" if fmt == "csv" else "ndjson", delimiter)
+
+        # Read a batch, then validate and write it under one write lock / commit
+        while True:
+            batch = list(islice(records, IMPORT_BATCH_ROWS))
+            if not batch:
+                break
+            summary["processed"] += len(batch)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                valid = []
+                for line, record in batch:
+                    try:
+                        valid.append((line, _validate_import_record(record, lookups)))
+                    except (ValueError, TypeError) as e:
+                        barcode = record.get("barcode") if isinstance(record, dict) else ""
+                        _import_error(summary, line, str(barcode or ""), str(e))
+                _write_import_batch(conn, valid, update, summary)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                CATALOG.clear()
+
+        if summary["inserted"] or summary["updated"]:
+            EVENTS.publish("catalog", {"action": "imported", "inserted": summary["inserted"],
+                                       "updated": summary["updated"]})
+
+        summary["errors"].sort(key=lambda error: error["row"])
+        summary["errors_truncated"] = summary["failed"] > len(summary["errors"])
+        summary["ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return jsonify({"success": True, **summary})
+
+    except Exception as e:
+        print(f"Error importing products: {e}")
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+# =========================================
+# BULK PRODUCT UPDATE
+# =========================================
+BULK_INT_FIELDS = ("quantity", "min_stock")
+BULK_PRICE_FIELDS = ("cost_price", "retail_price")
+BULK_PREVIEW_ROWS = 50
+
+
+def _bulk_assignments(set_values, adjust, price_decimals):
+    """SET clause + params from absolute values ({field: v}) and deltas ({field: d, price_field_pct: p})"""
+    clauses, params = [], []
+    for field in BULK_INT_FIELDS + BULK_PRICE_FIELDS:
+        cast = int if field in BULK_INT_FIELDS else float
+        if field in set_values:
+            expr, args = "?", [cast(set_values[field])]
+        elif field in adjust:
+            expr, args = f"COALESCE({field}, 0) + ?", [cast(adjust[field])]
+        elif f"{field}_pct" in adjust and field in BULK_PRICE_FIELDS:
+            expr, args = f"COALESCE({field}, 0) * (1 + ? / 100.0)", [float(adjust[f"{field}_pct"])]
+        else:
+            continue
+        if field in BULK_PRICE_FIELDS:
+            expr, args = f"MAX(ROUND({expr}, ?), 0)", args + [price_decimals]
+        else:
+            expr = f"MAX({expr}, 0)"
+        clauses.append(f"{field} = {expr}")
+        params.extend(args)
+    return clauses, params
+
+
+def _bulk_target_conditions(filters):
+    """SQL conditions + params selecting products by category_id / supplier_id / low_stock filters"""
+    where, params = [], []
+    if filters.get("category_id") is not None:
+        where.append("category_id = ?")
+        params.append(int(filters["category_id"]))
+    if filters.get("supplier_id") is not None:
+        where.append("supplier_id = ?")
+        params.append(int(filters["supplier_id"]))
+    if filters.get("low_stock"):
+        where.append("quantity <= min_stock")
+    return where, params
+
+
+@app.route("/api/products/bulk-update", methods=["POST"])
+def api_bulk_update_products():
+    """
+    Change many products in one transaction.
+    Targets: "barcodes": [...], or "filter": {category_id, supplier_id, low_stock} ("all": true for the whole catalog).
+    Changes: "set": {field: value} and/or "adjust": {field: delta, cost_price_pct / retail_price_pct: percent}
+    for quantity, min_stock, cost_price, retail_price; or per product "items": [{barcode, field: value, ...}]
+    (stocktake counts). Stock changes are written to the ledger as 'adjustment' rows.
+    "dry_run": true returns the preview and rolls back.
+    """
+    try:
+        data = request.get_json() or {}
+        set_values = data.get("set") or {}
+        adjust = data.get("adjust") or {}
+        items = data.get("items") or []
+        barcodes = [str(b).strip() for b in (data.get("barcodes") or []) if str(b).strip()]
+        filters = data.get("filter") or {}
+        note = (data.get("note") or "").strip()
+        dry_run = bool(data.get("dry_run"))
+        price_decimals = int(data.get("round", 2))
+
+        clauses, params = _bulk_assignments(set_values, adjust, price_decimals)
+        if items:
+            barcodes = [str(item.get("barcode") or "").strip() for item in items]
+            if not all(barcodes):
+                return jsonify({"success": False, "message": "Every item needs a barcode"}), 400
+        elif not clauses:
+            return jsonify({"success": False, "message": "Nothing to change: give set, adjust or items"}), 400
+        conditions, where_params = _bulk_target_conditions(filters)
+        if not barcodes and not conditions and not filters.get("all"):
+            return jsonify({"success": False, "message": "Give barcodes, a filter, or filter.all = true"}), 400
+
+        started = time.perf_counter()
+        conn = get_db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Snapshot of the targeted rows: drives the UPDATE and the before/after comparison
+            conn.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS bulk_before (
+                    id INTEGER PRIMARY KEY, barcode TEXT, quantity INTEGER, min_stock INTEGER,
+                    cost_price REAL, retail_price REAL
+                )
+            """)
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_barcodes (barcode TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM bulk_before")
+            conn.execute("DELETE FROM bulk_barcodes")
+            if barcodes:
+                conn.executemany("INSERT OR IGNORE INTO bulk_barcodes (barcode) VALUES (?)", [(b,) for b in barcodes])
+                conditions.insert(0, "barcode IN (SELECT barcode FROM bulk_barcodes)")
+            where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+            conn.execute(f"""
+                INSERT INTO bulk_before
+                SELECT id, barcode, quantity, min_stock, cost_price, retail_price FROM products {where}
+            """, where_params)
+            missing = [row["barcode"] for row in conn.execute("""
+                SELECT barcode FROM bulk_barcodes WHERE barcode NOT IN (SELECT barcode FROM bulk_before)
+            """)]
+
+            if clauses:
+                conn.execute(f"""
+                    UPDATE products SET {', '.join(clauses)}
+                    WHERE id IN (SELECT id FROM bulk_before)
+                """, params)
+            # Per-product values: one executemany per distinct set of fields
+            item_groups = {}
+            for barcode, item in zip(barcodes if items else [], items):
+                item_clauses, item_params = _bulk_assignments(item, {}, price_decimals)
+                if item_clauses:
+                    item_groups.setdefault(tuple(item_clauses), []).append(item_params + [barcode])
+            for item_clauses, rows in item_groups.items():
+                conn.executemany(f"""
+                    UPDATE products SET {', '.join(item_clauses)}
+                    WHERE barcode = ? AND id IN (SELECT id FROM bulk_before)
+                """, rows)
+
+            # One ledger row per product whose stock moved, value at cost
+            label = f"Bulk update - {note}" if note else "Bulk update"
+            _insert_ledger(conn, [dict(row) for row in conn.execute("""
+                SELECT p.id AS product_id, p.barcode, 'adjustment' AS transaction_type,
+                       p.quantity - b.quantity AS quantity, p.cost_price AS price,
+                       (p.quantity - b.quantity) * p.cost_price AS total_value, ? AS notes
+                FROM bulk_before b JOIN products p ON p.id = b.id
+                WHERE p.quantity IS NOT b.quantity
+            """, (label,))])
+
+            summary = conn.execute("""
+                SELECT COUNT(*) AS matched,
+                       COALESCE(SUM(p.quantity IS NOT b.quantity), 0) AS stock_adjustments,
+                       COALESCE(SUM(p.quantity - b.quantity), 0) AS units_delta,
+                       COALESCE(SUM(p.cost_price IS NOT b.cost_price OR p.retail_price IS NOT b.retail_price), 0)
+                           AS price_changes,
+                       COALESCE(SUM(p.min_stock IS NOT b.min_stock), 0) AS min_stock_changes,
+                       ROUND(COALESCE(SUM(p.quantity * p.retail_price - b.quantity * b.retail_price), 0), 2)
+                           AS retail_value_delta
+                FROM bulk_before b JOIN products p ON p.id = b.id
+            """).fetchone()
+            preview = conn.execute(f"""
+                SELECT p.barcode, p.name,
+                       b.quantity AS old_quantity, p.quantity,
+                       b.cost_price AS old_cost_price, p.cost_price,
+                       b.retail_price AS old_retail_price, p.retail_price,
+                       b.min_stock AS old_min_stock, p.min_stock
+                FROM bulk_before b JOIN products p ON p.id = b.id
+                ORDER BY p.name
+                LIMIT {BULK_PREVIEW_ROWS}
+            """).fetchall()
+
+            conn.execute("DELETE FROM bulk_before")
+            conn.execute("DELETE FROM bulk_barcodes")
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        if not dry_run and summary["matched"]:
+            CATALOG.clear()
+            EVENTS.publish("catalog", {"action": "bulk_updated", "count": summary["matched"]})
+
+        return jsonify({
+            "success": True,
+            "dry_run": dry_run,
+            **dict(summary),
+            "missing": missing[:IMPORT_MAX_ERRORS],
+            "preview": [dict(row) for row in preview],
+            "ms": round((time.perf_counter() - started) * 1000, 2)
+        })
+
+    except (ValueError, TypeError) as e:
+        return jsonify({"success": False, "message": f"Invalid value: {str(e)}"}), 400
+    except Exception as e:
+        print(f"Error in bulk update: {e}")
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+# =========================================
+# CSV EXPORT HELPERS (streamed)
+# =========================================
+EXPORT_FETCH_ROWS = 500          # rows fetched from SQLite per round
+EXPORT_FLUSH_BYTES = 64 * 1024   # CSV text buffered before it is sent to the client
+
+PRODUCT_EXPORT_SQL = """
+    SELECT p.*, c.name as category_name, s.name as supplier_name, s.id as supplier_id
+    FROM products p 
+    LEFT JOIN categories c ON p.category_id = c.id 
+    LEFT JOIN suppliers s ON p.supplier_id = s.id 
+    {where}
+    ORDER BY {order}
+"""
+
+
+def _stream_query(sql, params=()):
+    """
+    Yield rows of a query in EXPORT_FETCH_ROWS batches.
+    Runs while the response is being sent (after the request context is gone),
+    so it holds its own pooled connection until the generator finishes or is closed.
+    """
+    with POOL.connection() as conn:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_ROWS)
+            if not rows:
+                break
+            yield from rows
+
+
+def _stream_csv(header, rows, bom=False):
+    """Encode header + rows as CSV and yield UTF-8 chunks of about EXPORT_FLUSH_BYTES"""
+    buf = StringIO(newline="")
+    writer = csv.writer(buf)
+    if bom:
+        buf.write("\ufeff")
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= EXPORT_FLUSH_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
 # =========================================
 # EXPORT API - IMPROVED REPORTS WITH SUPPLIER ID
 # =========================================
@@ -1632,43 +4336,29 @@ def api_search_product_by_barcode(barcode):
 def api_export_products():
     """Export all products"""
     try:
-        conn = get_db_connection()
-        products = conn.execute("""
-            SELECT p.*, c.name as category_name, s.name as supplier_name, s.id as supplier_id
-            FROM products p 
-            LEFT JOIN categories c ON p.category_id = c.id 
-            LEFT JOIN suppliers s ON p.supplier_id = s.id 
-            ORDER BY p.name
-        """).fetchall()
-        conn.close()
-
-        # Create CSV
-        output = StringIO()
-        writer = csv.writer(output)
+        def rows():
+            for product in _stream_query(PRODUCT_EXPORT_SQL.format(where="", order="p.name")):
+                yield [
+                    product['supplier_id'] or '',
+                    product['barcode'],
+                    product['name'],
+                    product['description'] or '',
+                    product['category_name'] or '',
+                    product['supplier_name'] or '',
+                    product['quantity'],
+                    product['min_stock'],
+                    f"€{product['cost_price']:.2f}",
+                    f"€{product['retail_price']:.2f}"
+                ]
 
         # Header with supplier ID
-        writer.writerow([
+        header = [
             'Supplier ID', 'Barcode', 'Name', 'Description', 'Category', 'Supplier',
             'Quantity', 'Min Stock', 'Cost Price', 'Retail Price'
-        ])
-
-        # Data
-        for product in products:
-            writer.writerow([
-                product['supplier_id'] or '',
-                product['barcode'],
-                product['name'],
-                product['description'] or '',
-                product['category_name'] or '',
-                product['supplier_name'] or '',
-                product['quantity'],
-                product['min_stock'],
-                f"€{product['cost_price']:.2f}",
-                f"€{product['retail_price']:.2f}"
-            ])
+        ]
 
         return Response(
-            output.getvalue(),
+            _stream_csv(header, rows()),
             mimetype="text/csv",
             headers={
                 'X-Content-Type-Options': 'nosniff',
@@ -1685,53 +4375,39 @@ def api_export_products():
 def api_export_supplier_products(supplier_id):
     """Export products by supplier (English headers)"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
         # Check supplier exists
         supplier = conn.execute("SELECT name FROM suppliers WHERE id = ?", (supplier_id,)).fetchone()
         if not supplier:
-            conn.close()
             return jsonify({"success": False, "message": "Supplier not found"}), 404
 
-        products = conn.execute("""
-            SELECT p.*, c.name as category_name, s.name as supplier_name, s.id as supplier_id
-            FROM products p 
-            LEFT JOIN categories c ON p.category_id = c.id 
-            LEFT JOIN suppliers s ON p.supplier_id = s.id 
-            WHERE p.supplier_id = ?
-            ORDER BY p.name
-        """, (supplier_id,)).fetchall()
-        conn.close()
-
-        # Create CSV
-        output = StringIO()
-        writer = csv.writer(output)
+        def rows():
+            for product in _stream_query(PRODUCT_EXPORT_SQL.format(where="WHERE p.supplier_id = ?", order="p.name"),
+                                         (supplier_id,)):
+                yield [
+                    supplier_id,
+                    product['supplier_code'] or '',
+                    product['barcode'],
+                    product['name'],
+                    product['description'] or '',
+                    product['category_name'] or '',
+                    product['supplier_name'] or '',
+                    product['quantity'],
+                    product['min_stock'],
+                    f"{product['cost_price']:.2f}",
+                    f"{product['retail_price']:.2f}"
+                ]
 
         # English header with supplier code
-        writer.writerow([
+        header = [
             'Supplier ID', 'Supplier Code', 'Barcode', 'Name', 'Description',
             'Category', 'Supplier', 'Quantity', 'Min Stock', 'Cost Price', 'Retail Price'
-        ])
-
-        # Data
-        for product in products:
-            writer.writerow([
-                supplier_id,
-                product['supplier_code'] or '',
-                product['barcode'],
-                product['name'],
-                product['description'] or '',
-                product['category_name'] or '',
-                product['supplier_name'] or '',
-                product['quantity'],
-                product['min_stock'],
-                f"{product['cost_price']:.2f}",
-                f"{product['retail_price']:.2f}"
-            ])
+        ]
 
         filename = f"products_supplier_{supplier_id}_{supplier['name'].replace(' ', '_')}.csv"
         return Response(
-            output.getvalue(),
+            _stream_csv(header, rows()),
             mimetype="text/csv",
             headers={
                 'X-Content-Type-Options': 'nosniff',
@@ -1748,46 +4424,32 @@ def api_export_supplier_products(supplier_id):
 def api_export_low_stock():
     """Export low stock products"""
     try:
-        conn = get_db_connection()
-        products = conn.execute("""
-            SELECT p.*, c.name as category_name, s.name as supplier_name, s.id as supplier_id
-            FROM products p 
-            LEFT JOIN categories c ON p.category_id = c.id 
-            LEFT JOIN suppliers s ON p.supplier_id = s.id 
-            WHERE p.quantity <= p.min_stock
-            ORDER BY p.quantity ASC
-        """).fetchall()
-        conn.close()
-
-        # Create CSV
-        output = StringIO()
-        writer = csv.writer(output)
+        def rows():
+            for product in _stream_query(PRODUCT_EXPORT_SQL.format(where="WHERE p.quantity <= p.min_stock",
+                                                                    order="p.quantity ASC")):
+                status = "CRITICAL" if product['quantity'] == 0 else "LOW"
+                yield [
+                    product['supplier_id'] or '',
+                    product['barcode'],
+                    product['name'],
+                    product['description'] or '',
+                    product['category_name'] or '',
+                    product['supplier_name'] or '',
+                    product['quantity'],
+                    product['min_stock'],
+                    f"€{product['cost_price']:.2f}",
+                    f"€{product['retail_price']:.2f}",
+                    status
+                ]
 
         # Header with supplier ID
-        writer.writerow([
+        header = [
             'Supplier ID', 'Barcode', 'Name', 'Description', 'Category', 'Supplier',
             'Quantity', 'Min Stock', 'Cost Price', 'Retail Price', 'Status'
-        ])
-
-        # Data
-        for product in products:
-            status = "CRITICAL" if product['quantity'] == 0 else "LOW"
-            writer.writerow([
-                product['supplier_id'] or '',
-                product['barcode'],
-                product['name'],
-                product['description'] or '',
-                product['category_name'] or '',
-                product['supplier_name'] or '',
-                product['quantity'],
-                product['min_stock'],
-                f"€{product['cost_price']:.2f}",
-                f"€{product['retail_price']:.2f}",
-                status
-            ])
+        ]
 
         return Response(
-            output.getvalue(),
+            _stream_csv(header, rows()),
             mimetype="text/csv",
             headers={
                 'X-Content-Type-Options': 'nosniff',
@@ -1800,85 +4462,64 @@ def api_export_low_stock():
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
 
-@app.route("/api/export/purchase-orders")
-def api_export_purchase_orders():
-    """Export all purchase orders with items"""
-    try:
-        conn = get_db_connection()
-        orders = conn.execute("""
-            SELECT po.*, s.name as supplier_name, s.phone, s.email, s.id as supplier_id
-            FROM purchase_orders po
-            LEFT JOIN suppliers s ON po.supplier_id = s.id
-            ORDER BY po.order_date DESC
-        """).fetchall()
-
-        # Get items for each order
-        orders_with_items = []
-        for order in orders:
-            items = conn.execute("""
-                SELECT poi.*, p.name as actual_product_name
-                FROM purchase_order_items poi
-                LEFT JOIN products p ON poi.product_id = p.id
-                WHERE poi.order_id = ?
-            """, (order['id'],)).fetchall()
-            orders_with_items.append({
-                'order': dict(order),
-                'items': [dict(item) for item in items]
-            })
+PO_EXPORT_HEADER = [
+    'Supplier ID', 'Order Number', 'Supplier', 'Order Date',
+    'Expected Delivery', 'Status', 'Total Amount', 'Notes',
+    'Product', 'Barcode', 'Ordered Quantity', 'Received Quantity',
+    'Unit Price', 'Total Cost'
+]
 
-        conn.close()
-
-        # Create CSV
-        output = StringIO()
-        writer = csv.writer(output)
 
-        # Header with supplier ID
-        writer.writerow([
-            'Supplier ID', 'Order Number', 'Supplier', 'Order Date',
-            'Expected Delivery', 'Status', 'Total Amount', 'Notes',
-            'Product', 'Barcode', 'Ordered Quantity', 'Received Quantity',
-            'Unit Price', 'Total Cost'
-        ])
+def _po_export_rows(where="", params=()):
+    """
+    CSV rows for the purchase order exports: one row per item, or one bare row for an empty order.
+    Orders and their items come from a single joined query ordered by order, then item.
+    """
+    sql = f"""
+        SELECT po.id AS order_id, s.id AS supplier_id, po.order_number, s.name AS supplier_name,
+               po.order_date, po.expected_date, po.status, po.total_amount, po.notes,
+               poi.id AS item_id, poi.product_name, p.name AS actual_product_name, poi.barcode,
+               poi.quantity_ordered, poi.quantity_received, poi.unit_cost, poi.total_cost
+        FROM purchase_orders po
+        LEFT JOIN suppliers s ON po.supplier_id = s.id
+        LEFT JOIN purchase_order_items poi ON poi.order_id = po.id
+        LEFT JOIN products p ON poi.product_id = p.id
+        {where}
+        ORDER BY po.order_date DESC, po.id, poi.id
+    """
+    for _, lines in groupby(_stream_query(sql, params), key=lambda row: row['order_id']):
+        first = next(lines)
+        order_fields = [
+            first['supplier_id'] or '',
+            first['order_number'],
+            first['supplier_name'] or '',
+            first['order_date'],
+            first['expected_date'] or '',
+            first['status'],
+            f"€{first['total_amount']:.2f}",
+            first['notes'] or '',
+        ]
+        if first['item_id'] is None:
+            # If no items, write only basic fields
+            yield order_fields + ['', '', '', '', '', '']
+            continue
+        for item in chain([first], lines):
+            yield order_fields + [
+                item['product_name'] or item['actual_product_name'] or '',
+                item['barcode'] or '',
+                item['quantity_ordered'],
+                item['quantity_received'],
+                f"€{item['unit_cost']:.2f}",
+                f"€{item['total_cost']:.2f}"
+            ]
 
-        # Data
-        for order_data in orders_with_items:
-            order = order_data['order']
-            items = order_data['items']
-
-            if items:
-                for item in items:
-                    writer.writerow([
-                        order['supplier_id'] or '',
-                        order['order_number'],
-                        order['supplier_name'] or '',
-                        order['order_date'],
-                        order['expected_date'] or '',
-                        order['status'],
-                        f"€{order['total_amount']:.2f}",
-                        order['notes'] or '',
-                        item['product_name'] or item['actual_product_name'] or '',
-                        item['barcode'] or '',
-                        item['quantity_ordered'],
-                        item['quantity_received'],
-                        f"€{item['unit_cost']:.2f}",
-                        f"€{item['total_cost']:.2f}"
-                    ])
-            else:
-                # If no items, write only basic fields
-                writer.writerow([
-                    order['supplier_id'] or '',
-                    order['order_number'],
-                    order['supplier_name'] or '',
-                    order['order_date'],
-                    order['expected_date'] or '',
-                    order['status'],
-                    f"€{order['total_amount']:.2f}",
-                    order['notes'] or '',
-                    '', '', '', '', '', ''
-                ])
 
+@app.route("/api/export/purchase-orders")
+def api_export_purchase_orders():
+    """Export all purchase orders with items"""
+    try:
         return Response(
-            output.getvalue(),
+            _stream_csv(PO_EXPORT_HEADER, _po_export_rows()),
             mimetype="text/csv",
             headers={
                 'X-Content-Type-Options': 'nosniff',
@@ -1895,89 +4536,16 @@ def api_export_purchase_orders():
 def api_export_purchase_orders_by_supplier(supplier_id):
     """Export purchase orders by supplier"""
     try:
-        conn = get_db_connection()
+        conn = get_db()
 
         # Check supplier exists
         supplier = conn.execute("SELECT name FROM suppliers WHERE id = ?", (supplier_id,)).fetchone()
         if not supplier:
-            conn.close()
             return jsonify({"success": False, "message": "Supplier not found"}), 404
 
-        orders = conn.execute("""
-            SELECT po.*, s.name as supplier_name, s.phone, s.email, s.id as supplier_id
-            FROM purchase_orders po
-            LEFT JOIN suppliers s ON po.supplier_id = s.id
-            WHERE po.supplier_id = ?
-            ORDER BY po.order_date DESC
-        """, (supplier_id,)).fetchall()
-
-        # Get items for each order
-        orders_with_items = []
-        for order in orders:
-            items = conn.execute("""
-                SELECT poi.*, p.name as actual_product_name
-                FROM purchase_order_items poi
-                LEFT JOIN products p ON poi.product_id = p.id
-                WHERE poi.order_id = ?
-            """, (order['id'],)).fetchall()
-            orders_with_items.append({
-                'order': dict(order),
-                'items': [dict(item) for item in items]
-            })
-
-        conn.close()
-
-        # Create CSV
-        output = StringIO()
-        writer = csv.writer(output)
-
-        # Header with supplier ID
-        writer.writerow([
-            'Supplier ID', 'Order Number', 'Supplier', 'Order Date',
-            'Expected Delivery', 'Status', 'Total Amount', 'Notes',
-            'Product', 'Barcode', 'Ordered Quantity', 'Received Quantity',
-            'Unit Price', 'Total Cost'
-        ])
-
-        # Data
-        for order_data in orders_with_items:
-            order = order_data['order']
-            items = order_data['items']
-
-            if items:
-                for item in items:
-                    writer.writerow([
-                        order['supplier_id'] or '',
-                        order['order_number'],
-                        order['supplier_name'] or '',
-                        order['order_date'],
-                        order['expected_date'] or '',
-                        order['status'],
-                        f"€{order['total_amount']:.2f}",
-                        order['notes'] or '',
-                        item['product_name'] or item['actual_product_name'] or '',
-                        item['barcode'] or '',
-                        item['quantity_ordered'],
-                        item['quantity_received'],
-                        f"€{item['unit_cost']:.2f}",
-                        f"€{item['total_cost']:.2f}"
-                    ])
-            else:
-                writer.writerow([
-                    order['supplier_id'] or '',
-                    order['order_number'],
-                    order['supplier_name'] or '',
-                    order['order_date'],
-                    order['expected_date'] or '',
-                    order['status'],
-                    f"€{order['total_amount']:.2f}",
-                    order['notes'] or '',
-                    '', '', '', '', '', ''
-                ])
-
         filename = f"purchase_orders_{supplier['name'].replace(' ', '_')}.csv"
         return Response(
-            output.getvalue(),
+            _stream_csv(PO_EXPORT_HEADER, _po_export_rows("WHERE po.supplier_id = ?", (supplier_id,))),
             mimetype="text/csv",
             headers={
                 'X-Content-Type-Options': 'nosniff',
@@ -1998,79 +4566,6 @@ def api_export_purchase_orders_by_status(status):
         if status not in valid_statuses:
             return jsonify({"success": False, "message": "Invalid status"}), 400
 
-        conn = get_db_connection()
-        orders = conn.execute("""
-            SELECT po.*, s.name as supplier_name, s.phone, s.email, s.id as supplier_id
-            FROM purchase_orders po
-            LEFT JOIN suppliers s ON po.supplier_id = s.id
-            WHERE po.status = ?
-            ORDER BY po.order_date DESC
-        """, (status,)).fetchall()
-
-        # Get items for each order
-        orders_with_items = []
-        for order in orders:
-            items = conn.execute("""
-                SELECT poi.*, p.name as actual_product_name
-                FROM purchase_order_items poi
-                LEFT JOIN products p ON poi.product_id = p.id
-                WHERE poi.order_id = ?
-            """, (order['id'],)).fetchall()
-            orders_with_items.append({
-                'order': dict(order),
-                'items': [dict(item) for item in items]
-            })
-
-        conn.close()
-
-        # Create CSV
-        output = StringIO()
-        writer = csv.writer(output)
-
-        # Header with supplier ID
-        writer.writerow([
-            'Supplier ID', 'Order Number', 'Supplier', 'Order Date',
-            'Expected Delivery', 'Status', 'Total Amount', 'Notes',
-            'Product', 'Barcode', 'Ordered Quantity', 'Received Quantity',
-            'Unit Price', 'Total Cost'
-        ])
-
-        # Data
-        for order_data in orders_with_items:
-            order = order_data['order']
-            items = order_data['items']
-
-            if items:
-                for item in items:
-                    writer.writerow([
-                        order['supplier_id'] or '',
-                        order['order_number'],
-                        order['supplier_name'] or '',
-                        order['order_date'],
-                        order['expected_date'] or '',
-                        order['status'],
-                        f"€{order['total_amount']:.2f}",
-                        order['notes'] or '',
-                        item['product_name'] or item['actual_product_name'] or '',
-                        item['barcode'] or '',
-                        item['quantity_ordered'],
-                        item['quantity_received'],
-                        f"€{item['unit_cost']:.2f}",
-                        f"€{item['total_cost']:.2f}"
-                    ])
-            else:
-                writer.writerow([
-                    order['supplier_id'] or '',
-                    order['order_number'],
-                    order['supplier_name'] or '',
-                    order['order_date'],
-                    order['expected_date'] or '',
-                    order['status'],
-                    f"€{order['total_amount']:.2f}",
-                    order['notes'] or '',
-                    '', '', '', '', '', ''
-                ])
-
         status_text = {
             'pending': 'pending',
             'ordered': 'ordered',
@@ -2079,7 +4574,7 @@ def api_export_purchase_orders_by_status(status):
         }
         filename = f"purchase_orders_{status_text[status]}.csv"
         return Response(
-            output.getvalue(),
+            _stream_csv(PO_EXPORT_HEADER, _po_export_rows("WHERE po.status = ?", (status,))),
             mimetype="text/csv",
             headers={
                 'X-Content-Type-Options': 'nosniff',
@@ -2112,8 +4607,7 @@ def export_single_order(order_id):
     import csv, io, sqlite3
     from flask import Response
 
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
     order = cur.execute("""
@@ -2131,7 +4625,6 @@ def export_single_order(order_id):
         LEFT JOIN products p ON p.id = i.product_id
         WHERE i.order_id = ?
     """, (order_id,)).fetchall()
-    conn.close()
 
     if not order:
         return Response("Order not found", status=404)
@@ -2211,7 +4704,7 @@ def watch_pos_trigger():
 def run_flask():
     try:
         from waitress import serve
-        serve(app, host="127.0.0.1", port=5000)
+        serve(app, host="127.0.0.1", port=5000, threads=SERVER_THREADS)
     except Exception as e:
         print(f"Server error: {e}")
         app.run(host="127.0.0.1", port=5000, debug=False)
@@ -2290,72 +4783,11 @@ class BridgeAPI:
     """pywebview JS bridge: saves CSV purchase order files locally and returns the file path"""
 
     def export_purchase_order_file(self, order_id: int):
-        import csv
-        from io import StringIO
-
-        conn = get_db_connection()
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT po.*, s.name AS supplier_name
-            FROM purchase_orders po
-            LEFT JOIN suppliers s ON s.id = po.supplier_id
-            WHERE po.id = ?
-        """, (order_id,))
-        order = cur.fetchone()
+        with POOL.connection() as conn:
+            order, csv_bytes = _purchase_order_file_csv(conn, order_id)
         if not order:
-            conn.close()
             return {"success": False, "message": "Purchase order not found"}
 
-        cur.execute("""
-            SELECT poi.*, p.name AS actual_product_name, p.supplier_code
-            FROM purchase_order_items poi
-            LEFT JOIN products p ON p.id = poi.product_id
-            WHERE poi.order_id = ?
-            ORDER BY poi.id
-        """, (order_id,))
-        items = cur.fetchall()
-        conn.close()
-
-        out = StringIO(newline="")
-        w = csv.writer(out)
-        w.writerow(["Purchase Order"])
-        w.writerow(["Order ID", order["id"]])
-        w.writerow(["Order Number", order["order_number"] or ""])
-        w.writerow(["Supplier", order["supplier_name"] or ""])
-        w.writerow(["Order Date", order["order_date"] or ""])
-        w.writerow(["Status", order["status"] or ""])
-        w.writerow(["Total Amount", f'{(order["total_amount"] or 0):.2f}'])
-        w.writerow(["Notes", order["notes"] or ""])
-        w.writerow([])
-
-        w.writerow(["#", "Supplier Code", "Product ID", "Product Name", "Barcode",
-                    "Qty Ordered", "Qty Received", "Unit Cost", "Line Total"])
-        total = 0.0
-        for i, it in enumerate(items, start=1):
-            qtyo = it["quantity_ordered"] or 0
-            qyr = it["quantity_received"] or 0
-            cost = float(it["unit_cost"] or 0)
-            line = float(it["total_cost"] or (qtyo * cost))
-            total += line
-            w.writerow([
-                i,
-                it["supplier_code"] or "",
-                it["product_id"] or "",
-                it["product_name"] or it["actual_product_name"] or "",
-                it["barcode"] or "",
-                qtyo,
-                qyr,
-                f"{cost:.2f}",
-                f"{line:.2f}",
-            ])
-        w.writerow([])
-        w.writerow(["Computed Total", f"{total:.2f}"])
-
-        csv_text = out.getvalue()
-        csv_bytes = csv_text.encode("utf-8-sig")  # BOM for Excel on Windows
-
         safe_num = order["order_number"] or f"PO{order['id']}"
         fname = f"purchase_order_{safe_num}.csv"
         fpath = os.path.join(EXPORTS_DIR, fname)
@@ -2374,6 +4806,27 @@ if __name__ == "__main__":
     # Initialize DB
     init_database()
 
+    if "--rebuild-rollup" in sys.argv:
+        rebuild_sales_rollup()
+        sys.exit(0)
+    if "--check-stats" in sys.argv:
+        print(check_inventory_stats())
+        sys.exit(0)
+    if "--archive-ledger" in sys.argv:
+        print(archive_ledger(vacuum=True))
+        sys.exit(0)
+
+    if "--forecast" in sys.argv:
+        print(refresh_forecasts())
+        sys.exit(0)
+
+    if ARCHIVE_AUTO:
+        print(f"Ledger auto-archive is on: closed months older than {ARCHIVE_KEEP_MONTHS} months move to "
+              f"{POOL.archive_path} - back up this file together with {DB_PATH}")
+
+    # Forecast refresh (and ledger archival when enabled) run in the background, then once a day
+    threading.Thread(target=_background_maintenance, daemon=True).start()
+
     # Bridge for webview (if available)
     try:
         BRIDGE_API = BridgeAPI()
@@ -0,0 +1,112 @@
+# po_export_benchmark.py
+"""
+Purchase order CSV export: time vs. number of orders.
+
+Compares the joined, streamed export used by /api/export/purchase-orders/...
+(one query) with the old "one purchase_order_items query per order" approach
+(orders + 1 queries) on a throw-away database.
+
+Usage:
+    python benchmarks/po_export_benchmark.py [order counts...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Shoplite_POS as app  # noqa: E402
+
+ITEMS_PER_ORDER = 5
+PRODUCTS = 500
+
+
+def build_database(path, orders):
+    pool = app.ConnectionPool(path)
+    app.POOL = pool
+    with pool.connection() as conn:
+        app.run_migrations(conn)
+        conn.execute("INSERT INTO suppliers (name) VALUES ('Benchmark supplier')")
+        conn.executemany("""
+            INSERT INTO products (barcode, name, quantity, cost_price, retail_price, supplier_id)
+            VALUES (?, ?, 10, 1.0, 2.0, 1)
+        """, [(f"BC{i:06d}", f"Product {i}") for i in range(PRODUCTS)])
+        conn.executemany("""
+            INSERT INTO purchase_orders (id, supplier_id, order_number, total_amount, status)
+            VALUES (?, 1, ?, ?, 'pending')
+        """, [(o, f"PO{o:07d}", ITEMS_PER_ORDER * 2.5) for o in range(1, orders + 1)])
+        conn.executemany("""
+            INSERT INTO purchase_order_items
+                (order_id, product_id, barcode, product_name, quantity_ordered, unit_cost, total_cost)
+            VALUES (?, ?, ?, ?, 2, 1.25, 2.5)
+        """, [(o, (o * ITEMS_PER_ORDER + k) % PRODUCTS + 1, f"BC{(o * ITEMS_PER_ORDER + k) % PRODUCTS:06d}", "Item")
+              for o in range(1, orders + 1) for k in range(ITEMS_PER_ORDER)])
+        conn.commit()
+    return pool
+
+
+def export_joined():
+    size = 0
+    for chunk in app._stream_csv(app.PO_EXPORT_HEADER, app._po_export_rows()):
+        size += len(chunk)
+    return size
+
+
+def _n_plus_one_rows():
+    """The previous implementation: orders first, then one items query per order"""
+    with app.POOL.connection() as conn:
+        orders = conn.execute("""
+            SELECT po.*, s.name as supplier_name, s.id as supplier_id
+            FROM purchase_orders po
+            LEFT JOIN suppliers s ON po.supplier_id = s.id
+            ORDER BY po.order_date DESC
+        """).fetchall()
+        for order in orders:
+            items = conn.execute("""
+                SELECT poi.*, p.name as actual_product_name
+                FROM purchase_order_items poi
+                LEFT JOIN products p ON poi.product_id = p.id
+                WHERE poi.order_id = ?
+            """, (order['id'],)).fetchall()
+            order_fields = [
+                order['supplier_id'] or '', order['order_number'], order['supplier_name'] or '',
+                order['order_date'], order['expected_date'] or '', order['status'],
+                f"€{order['total_amount']:.2f}", order['notes'] or '',
+            ]
+            if not items:
+                yield order_fields + ['', '', '', '', '', '']
+            for item in items:
+                yield order_fields + [
+                    item['product_name'] or item['actual_product_name'] or '',
+                    item['barcode'] or '', item['quantity_ordered'], item['quantity_received'],
+                    f"€{item['unit_cost']:.2f}", f"€{item['total_cost']:.2f}",
+                ]
+
+
+def export_n_plus_one():
+    size = 0
+    for chunk in app._stream_csv(app.PO_EXPORT_HEADER, _n_plus_one_rows()):
+        size += len(chunk)
+    return size
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def main(counts):
+    print(f"{'orders':>8} {'lines':>8} {'joined ms':>10} {'n+1 ms':>10} {'n+1 queries':>12}")
+    for orders in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = build_database(os.path.join(tmp, "bench.db"), orders)
+            joined = min(timed(export_joined) for _ in range(3))
+            n_plus_one = min(timed(export_n_plus_one) for _ in range(3))
+            pool.close_all()
+        print(f"{orders:>8} {orders * ITEMS_PER_ORDER:>8} {joined:>10.1f} {n_plus_one:>10.1f} {orders + 1:>12}")
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [100, 1000, 5000, 20000])
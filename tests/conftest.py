@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+# The app keeps its database under the user's Documents folder; point it at a scratch home
+os.environ["HOME"] = tempfile.mkdtemp(prefix="shoplite-tests-")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Shoplite_POS  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    Shoplite_POS.init_database()
+    return Shoplite_POS
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def product(client):
+    """A fresh product; returns its barcode"""
+    counter = getattr(product, "counter", 0) + 1
+    product.counter = counter
+    barcode = f"T{counter:05d}"
+    response = client.post("/api/products", json={
+        "barcode": barcode, "name": f"Test product {counter}", "quantity": 10,
+        "cost_price": 1.0, "retail_price": 2.0
+    })
+    assert response.status_code in (200, 201), response.get_json()
+    return barcode
+
+
+@pytest.fixture
+def create_order(client):
+    """POST /api/purchase-orders; returns the order id (order numbers are per second, so retry a clash)"""
+    def create(supplier_id, items):
+        for _ in range(3):
+            response = client.post("/api/purchase-orders", json={"supplier_id": supplier_id, "items": items})
+            if response.status_code == 200 and response.get_json().get("success"):
+                return response.get_json()["order_id"]
+            time.sleep(1)
+        raise AssertionError(response.get_json())
+    return create
@@ -0,0 +1,15 @@
+import os
+
+
+def test_missing_archive_file_is_recreated(app_module, client):
+    pool = app_module.ConnectionPool(app_module.DB_PATH, max_connections=1)
+    os.remove(pool.archive_path)   # only warehouse.db restored from a backup
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(pool.archive_path + suffix):
+            os.remove(pool.archive_path + suffix)
+
+    conn = pool.acquire()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM transactions_all").fetchone()[0] >= 0
+    finally:
+        pool.release(conn)
@@ -0,0 +1,14 @@
+def test_stock_adjustment_writes_ledger_rows(app_module, client, product):
+    response = client.post("/api/products/bulk-update", json={
+        "barcodes": [product], "adjust": {"quantity": 3}, "note": "bulk-ledger-test"
+    })
+    data = response.get_json()
+
+    assert response.status_code == 200, data
+    assert data["stock_adjustments"] == 1
+    with app_module.POOL.connection() as conn:
+        rows = conn.execute("""
+            SELECT transaction_type, quantity, price FROM transactions
+            WHERE barcode = ? AND notes = 'Bulk update - bulk-ledger-test'
+        """, (product,)).fetchall()
+    assert [tuple(row) for row in rows] == [("adjustment", 3, 1.0)]
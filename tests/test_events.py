@@ -0,0 +1,7 @@
+def test_head_requests_do_not_leak_stream_slots(app_module, client):
+    for _ in range(app_module.EVENTS.max_subscribers + 1):
+        response = client.head("/api/events")
+        response.close()
+        assert response.status_code == 200
+
+    assert app_module.EVENTS.stats()["subscribers"] == 0
@@ -0,0 +1,30 @@
+def _get(client, barcode):
+    return client.get(f"/api/products/{barcode}").get_json()["product"]
+
+
+def test_partial_column_import_updates_existing_product(client, product):
+    before = _get(client, product)
+    body = f"Barcode,Cost Price\n{product},€1.50\n"
+    response = client.post("/api/products/import", data=body.encode("utf-8"), content_type="text/csv")
+    data = response.get_json()
+
+    assert response.status_code == 200, data
+    assert data["updated"] == 1 and data["failed"] == 0
+    after = _get(client, product)
+    assert after["cost_price"] == 1.5
+    assert after["name"] == before["name"]
+    assert after["quantity"] == before["quantity"]
+    assert after["retail_price"] == before["retail_price"]
+
+
+def test_repeated_barcode_last_row_wins(client, product):
+    body = (f"barcode,retail_price,quantity\n"
+            f"{product},3.00,5\n"
+            f"{product},4.00,\n"
+            f"{product},,7\n")
+    response = client.post("/api/products/import", data=body.encode("utf-8"), content_type="text/csv")
+
+    assert response.status_code == 200, response.get_json()
+    after = _get(client, product)
+    assert after["retail_price"] == 4.0
+    assert after["quantity"] == 7
@@ -0,0 +1,23 @@
+def _row(product_id, barcode, note):
+    return {"product_id": product_id, "barcode": barcode, "transaction_type": "sale", "quantity": 1,
+            "price": 2.0, "total_value": 2.0, "notes": note, "unit_cost": 1.0, "timestamp": None}
+
+
+def test_row_for_deleted_product_does_not_block_batch(app_module, client, product):
+    other = client.post("/api/products", json={"barcode": product + "-keep", "name": "Kept", "quantity": 1})
+    assert other.status_code in (200, 201)
+    deleted_id = client.get(f"/api/products/{product}").get_json()["product"]["id"]
+    kept_id = client.get(f"/api/products/{product}-keep").get_json()["product"]["id"]
+    assert client.delete(f"/api/products/{product}").status_code == 200
+
+    writer = app_module.LedgerWriter(True)
+    writer._write([_row(deleted_id, product, "ledger-writer-test"),
+                   _row(kept_id, product + "-keep", "ledger-writer-test")], max_attempts=1)
+
+    assert writer.written == 2
+    assert writer.dead_lettered == 0
+    with app_module.POOL.connection() as conn:
+        rows = conn.execute("""
+            SELECT product_id, barcode FROM transactions WHERE notes = 'ledger-writer-test' ORDER BY id
+        """).fetchall()
+    assert [tuple(row) for row in rows] == [(None, product), (kept_id, product + "-keep")]
@@ -0,0 +1,13 @@
+def test_legacy_in_progress_orders_count_as_on_order(client, product, create_order):
+    supplier_id = client.post("/api/suppliers", json={"name": f"Supplier {product}"}).get_json()["supplier"]["id"]
+    row = client.get(f"/api/products/{product}").get_json()["product"]
+    client.put(f"/api/products/{product}", json={**row, "quantity": 0, "min_stock": 5, "supplier_id": supplier_id})
+
+    order_id = create_order(supplier_id, [{"product_id": row["id"], "barcode": product, "product_name": row["name"],
+                                           "quantity_ordered": 20, "unit_cost": 1.0}])
+    client.put(f"/api/purchase-orders/{order_id}/status", json={"status": "σε εξέλιξη"})
+
+    response = client.post("/api/purchase-orders/generate", json={"supplier_id": supplier_id, "dry_run": True})
+
+    assert response.status_code == 200
+    assert response.get_json()["orders"] == []
@@ -0,0 +1,24 @@
+def test_lines_for_same_product_are_received_separately(client, product, create_order):
+    product_row = client.get(f"/api/products/{product}").get_json()["product"]
+    line = {"product_id": product_row["id"], "barcode": product, "product_name": product_row["name"]}
+    supplier_id = client.post("/api/suppliers", json={"name": f"Supplier {product}"}).get_json()["supplier"]["id"]
+    order_id = create_order(supplier_id, [
+        {**line, "quantity_ordered": 5, "unit_cost": 1.0},
+        {**line, "quantity_ordered": 4, "unit_cost": 2.0},
+    ])
+    first, second = client.get(f"/api/purchase-orders/{order_id}").get_json()["items"]
+
+    response = client.put(f"/api/purchase-orders/{order_id}/status", json={
+        "status": "received",
+        "receipt_key": f"test-{order_id}-1",
+        "items": [{"item_id": first["id"], "quantity": 2, "new_cost": 1.0},
+                  {"item_id": second["id"], "quantity": 3, "new_cost": 2.5}]
+    })
+    data = response.get_json()
+
+    assert response.status_code == 200, data
+    assert data["received_units"] == 5 and data["status"] == "partial"
+    items = {item["id"]: item for item in client.get(f"/api/purchase-orders/{order_id}").get_json()["items"]}
+    assert (items[first["id"]]["quantity_received"], items[first["id"]]["unit_cost"]) == (2, 1.0)
+    assert (items[second["id"]]["quantity_received"], items[second["id"]]["unit_cost"]) == (3, 2.5)
+    assert client.get(f"/api/products/{product}").get_json()["product"]["quantity"] == product_row["quantity"] + 5
@@ -0,0 +1,35 @@
+import base64
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor!",
+    base64.urlsafe_b64encode(b"{not json").decode("ascii"),
+    base64.urlsafe_b64encode(json.dumps({"name": "x"}).encode("utf-8")).decode("ascii"),
+    base64.urlsafe_b64encode(json.dumps(["x", "1"]).encode("utf-8")).decode("ascii"),
+    "ÿÿ",
+])
+def test_garbage_cursor_is_a_400(client, cursor):
+    response = client.get("/api/products", query_string={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_non_integer_filter_is_a_400(client):
+    response = client.get("/api/products", query_string={"category_id": "abc"})
+
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_cursor_round_trip(client, product):
+    client.post("/api/products", json={"barcode": product + "-2", "name": "Second product", "quantity": 1})
+    first = client.get("/api/products", query_string={"limit": 1}).get_json()
+    assert first["next_cursor"]
+
+    second = client.get("/api/products", query_string={"limit": 1, "cursor": first["next_cursor"]})
+    assert second.status_code == 200
+    assert second.get_json()["items"][0]["id"] != first["items"][0]["id"]
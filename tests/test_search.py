@@ -0,0 +1,20 @@
+def test_fuzzy_results_page_consistently(client):
+    for i in range(5):
+        client.post("/api/products", json={"barcode": f"FZ{i}", "name": f"Chocolate bar {i}", "quantity": 1})
+
+    first = client.get("/api/products/search", query_string={"q": "chocolote", "limit": 3}).get_json()
+    second = client.get("/api/products/search", query_string={"q": "chocolote", "limit": 3, "offset": 3}).get_json()
+
+    assert first["fuzzy"] and first["has_more"]
+    assert second["fuzzy"]
+    assert len(second["products"]) == 2
+    names = {p["name"] for p in first["products"]} | {p["name"] for p in second["products"]}
+    assert names == {f"Chocolate bar {i}" for i in range(5)}
+
+
+def test_paging_past_exact_results_is_empty(client):
+    client.post("/api/products", json={"barcode": "EX1", "name": "Exactword thing", "quantity": 1})
+
+    response = client.get("/api/products/search", query_string={"q": "exactword", "offset": 5}).get_json()
+
+    assert response["products"] == [] and response["fuzzy"] is False